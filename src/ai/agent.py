@@ -1,25 +1,332 @@
-import os, re, json, time
+import re, time
+import atexit
 import logging
+import threading
+import heapq
+from collections import OrderedDict
+from functools import lru_cache
+from pathlib import Path
 from ai.templates import CodeTemplates
 from ai.context_manager import ContextManager
-from ai.online_search import OnlineSearchManager
-from ai.model_setup import load_optimized_model, get_optimal_generation_params
+from ai.model_setup import load_optimized_model, get_optimal_generation_params, wait_until_warm
+import jsonutil
 
 logger = logging.getLogger("hybrid_ide_ai")  # Usar logger específico de IA
+_API_LOGGER = logging.getLogger("hybrid_ide_api")  # Logs do fluxo de requisições (reply_chat)
+
+# Caminhos de persistência resolvidos uma única vez
+_ASSETS_DIR = Path(__file__).resolve().parent.parent / 'assets'
+_HEALTH_PATH = _ASSETS_DIR / 'health_status.json'
+
+_CACHE_TTL = 24 * 3600  # Validade das respostas em cache (24 horas)
+_SHORT_PROMPT_LEN = 32  # Prompts abaixo disso usam o caminho rápido do chat
+
+
+# Padrões de regex pré-compilados (evita lookup no cache do módulo re a cada chamada)
+# Comandos são procurados no texto já sem scripts: "ev<script></script>al" vira "eval" e é removido
+_SANITIZE_SCRIPT_RE = re.compile(r'<script.*?>.*?</script>', re.IGNORECASE | re.DOTALL)
+_SANITIZE_CMDS_RE = re.compile(r'(rm\s+-rf|shutdown|format\s+|os\.system|subprocess|exec|eval|open\(|import\s+os|import\s+sys)', re.IGNORECASE)
+_CTRL_TABLE = dict.fromkeys([*range(0x20), 0x7F])  # Caracteres de controle -> removidos
+
+_PROBLEMATIC_RE = re.compile('|'.join(f'(?:{p})' for p in (
+    # Respostas evasivas ou vazias
+    r"não (sei|entendi|posso)",
+    r"desculpe, mas não",
+    r"não tenho certeza",
+    # Fingindo experiências
+    r"quando (eu|nós) (usei|fiz)",
+    r"na minha vida",
+    r"minha experiência pessoal",
+    # Extremamente genérico
+    r"^é importante$",
+    r"^existem várias$",
+    r"^depende$",
+    # Robótico demais
+    r"^processando sua solicitação$",
+    r"^conforme solicitado$",
+    r"^executando comando$"
+)))
+_WORD_RE = re.compile(r'\w+')
+_PROBLEMATIC_SCAN_LIMIT = 2000  # Padrões problemáticos aparecem no início da resposta
+_RELEVANCE_SCAN_LIMIT = 4000    # Prefixo suficiente para medir relevância
+
+_PYTHON_HINTS = '|'.join(f'(?:{p})' for p in (
+    r'python|\.py|script python',  # Menções diretas
+    r'input\s*\(|print\s*\(',      # Funções comuns
+    r'def\s+\w+|class\s+\w+',     # Definições
+    r'while\s+|for\s+in',         # Loops
+    r'if\s+.*:|else\s*:',         # Condicionais
+    r'import\s+\w+',              # Imports
+    r'lista|dicionário|tupla',    # Tipos de dados
+    r'variável|função|método',     # Termos em português
+    r'calcul|loop|repet',         # Conceitos gerais
+    r'tabuada|número|soma'        # Termos matemáticos
+))
+
+# Detecção de linguagem em ordem de prioridade: (grupo, linguagem, padrão)
+_LANG_DETECT_RULES = (
+    ('python', 'python', _PYTHON_HINTS),
+    ('javascript', 'javascript', r'javascript|js|node|\.js'),
+    ('html', 'html', r'html|página|site|blog|css'),
+    ('java', 'java', r'java|\.java|classe|public class'),
+    ('cpp', 'cpp', r'c\+\+|cpp|\.cpp'),
+    ('python_fn', 'python', r'função|def|return|print'),  # Default para funções simples
+    ('html_layout', 'html', r'página|estilo|layout|design'),  # Default para conteúdo web
+)
+# Lookahead em cada posição: uma única varredura encontra todas as regras que casam,
+# inclusive sobrepostas, e a de maior prioridade vence (mesmo resultado da cascata)
+_LANG_DETECT_RE = re.compile(
+    '(?=' + '|'.join(f'(?P<{group}>{pattern})' for group, _, pattern in _LANG_DETECT_RULES) + ')'
+)
+_LANG_DETECT_RANK = {group: rank for rank, (group, _, _) in enumerate(_LANG_DETECT_RULES)}
+
+_LANG_PT_RE = re.compile(r'[ãêõçáéíóúâêôà]|você|exemplo|código|explicação')
+_LANG_ES_RE = re.compile(r'[ñáéíóú]|usted|código|ejemplo|explicar')
+
+# Termos literais: uma única alternação escapada varre o prompt uma só vez
+_CODE_KEYWORDS = (
+    # Português e inglês
+    "html", "css", "div", "body", "head", "form", "input", "campo", "tabela", "table", "style", "layout", "visual", "página", "pagina", "exiba", "exibir", "mostre", "mostrar", "botão", "botao", "button",
+    "crie", "faça", "faça um", "faça uma", "faça o", "faça a", "código", "código para", "exemplo de código", "script", "programa", "implemente", "front", "frontend", "python", "javascript", "js", "json", "salvar como", "template", "arquivo ",
+    "escreva", "gere", "demonstre", "complete o código", "monte um", "criar um código", "criar um html", "desenvolva", "interface", "interface web", "em html", "em js", "em css",
+    # Inglês (para pegar de tudo)
+    "code", "generate an html", "create an html", "show code", "display code", "create a form", "make an html", "generate code", "script in python", "script in js", "script in html",
+)
+_CODE_REQUEST_RE = re.compile('|'.join(map(re.escape, _CODE_KEYWORDS)))
+
+# Palavras-chave que indicam necessidade de informação atual
+_SEARCH_INDICATORS = (
+    'como funciona',
+    'o que é',
+    'explique',
+    'me fale sobre',
+    'qual',
+    'quando',
+    'onde',
+    'por que',
+    'documentação',
+    'exemplo de',
+    'tutorial',
+    'erro',
+    'problema com',
+    'versão atual',
+    'última versão',
+    'api',
+    'biblioteca',
+    'framework'
+)
+_SEARCH_INDICATORS_RE = re.compile('|'.join(map(re.escape, _SEARCH_INDICATORS)))
+
+# Conjuntos de palavras-chave constantes (evita recriar listas a cada chamada)
+_CREATIVE_WORDS = frozenset(("criativo", "imagine", "crie", "desenhe", "design"))
+_PRECISE_WORDS = frozenset(("exato", "preciso", "técnico", "específico"))
+_DETAIL_WORDS = frozenset(('explique', 'detalhe', 'como'))
+_EXPLAIN_WORDS = frozenset(('explique', 'detalhe', 'descreva', 'como', 'exemplo'))
+_CMD_WORDS = frozenset(('gere', 'crie', 'faça', 'mostre'))
+_QUESTION_WORDS = frozenset(('como', 'qual', 'quando', 'onde', 'por que'))
+_CONTINUATION_WORDS = frozenset(('continue', 'adicione', 'modifique', 'melhore'))
+
+# Instruções para respostas naturais e precisas
+_CORE_INSTRUCTIONS = "\n".join((
+    "Mantenha um tom conversacional natural.",
+    "Seja preciso e direto nas respostas.",
+    "Use linguagem clara e acessível.",
+    "Evite formalidades ou prefixos desnecessários.",
+    "Seja objetivo mas mantenha empatia.",
+    "Comunique com entusiasmo genuíno."
+))
+_PROGRAMMING_INSTRUCTIONS = "\n".join((
+    _CORE_INSTRUCTIONS,
+    "Foque em explicações técnicas e código.",
+    "Use exemplos específicos e práticos.",
+    "Cite fontes técnicas quando relevante."
+))
+
+# Exemplos de código mais contextuais e abrangentes
+_LANGUAGE_EXAMPLES = {
+    'python': {
+        'basic': 'def calcular_media(numeros):\n    return sum(numeros) / len(numeros) if numeros else 0',
+        'advanced': 'class GerenciadorTarefas:\n    def __init__(self):\n        self.tarefas = []\n    \n    def adicionar_tarefa(self, tarefa):\n        self.tarefas.append({"descricao": tarefa, "concluida": False})\n    \n    def listar_tarefas(self):\n        return [t["descricao"] for t in self.tarefas]\n',
+        'error_handling': 'def dividir(a, b):\n    try:\n        return a / b\n    except ZeroDivisionError:\n        return "Erro: Divisão por zero não permitida"\n'
+    },
+    'javascript': {
+        'basic': 'function gerarNumeroAleatorio(min, max) {\n    return Math.floor(Math.random() * (max - min + 1)) + min;\n}',
+        'advanced': 'class GerenciadorEstado {\n    constructor() {\n        this.estado = {};\n    }\n\n    definirEstado(chave, valor) {\n        this.estado[chave] = valor;\n    }\n\n    obterEstado(chave) {\n        return this.estado[chave];\n    }\n}',
+        'async': 'async function buscarDadosAPI(url) {\n    try {\n        const resposta = await fetch(url);\n        return await resposta.json();\n    } catch (erro) {\n        console.error("Erro na busca:", erro);\n        return null;\n    }\n'
+    },
+    'html': {
+        'basic': '<!DOCTYPE html>\n<html lang="pt-BR">\n<head>\n    <meta charset="UTF-8">\n    <title>Página Simples</title>\n</head>\n<body>\n    <h1>Olá, Mundo!</h1>\n</body>\n</html>',
+        'form': '<!DOCTYPE html>\n<html lang="pt-BR">\n<head>\n    <meta charset="UTF-8">\n    <title>Formulário de Contato</title>\n    <style>\n        body { font-family: Arial, sans-serif; max-width: 400px; margin: 0 auto; }\n        input, textarea { width: 100%; margin: 10px 0; }\n    </style>\n</head>\n<body>\n    <form>\n        <input type="text" placeholder="Nome" required>\n        <input type="email" placeholder="E-mail" required>\n        <textarea placeholder="Sua mensagem" required></textarea>\n        <button type="submit">Enviar</button>\n    </form>\n</body>\n</html>'
+    }
+}
+
+# Stop tokens por linguagem. Mantidos como listas: o llama_cpp descarta
+# silenciosamente valores de `stop` que não sejam str ou list.
+_CODE_STOPS = {
+    'python': ['\ndef ', '```', '###', '\n# ', '\nclass '],
+    'html': ['</html>', '```', '<!----', '<!--', '</body>'],
+    'javascript': ['\nfunction ', '```', '//', '/*', '\nconst ', '\nlet '],
+    'java': ['\npublic ', '```', '//'],
+    'cpp': ['\n#include ', '```', '//']
+}
+_DEFAULT_CODE_STOPS = ['```']
+
+# Prompts de geração por linguagem (preenchidos com str.format)
+_CODE_PROMPT_TEMPLATES = {
+    'python': """Escreva apenas o código Python para: {msg}
+
+O código deve:
+- Ser funcional e pronto para executar
+- Incluir tratamento de erros básico
+- Ter comentários explicativos
+- Seguir PEP 8
+- Não ter cabeçalhos ou docstrings desnecessários
+
+{code_context}""",
+    'javascript': "Gere exclusivamente código JavaScript funcional e completo para:\n{msg}\n{code_context}",
+    'html': "Gere exclusivamente código HTML/CSS funcional e completo para:\n{msg}\n{code_context}",
+    'java': "Gere exclusivamente código Java funcional e completo para:\n{msg}\n{code_context}",
+    'cpp': "Gere exclusivamente código C++ funcional e completo para:\n{msg}\n{code_context}"
+}
+
+def _has_python_keyword(code):
+    """Pré-filtro por substring (sem regex) para as palavras-chave de Python."""
+    return 'def' in code or 'class' in code or 'import' in code
+
+
+# Verificações mínimas de código gerado, por linguagem (todas precisam casar).
+# Cada item é (verificação, limite de caracteres ou None para o código todo),
+# ordenado da verificação mais barata/seletiva para a mais cara.
+_CODE_CHECKS = {
+    'python': (
+        (_has_python_keyword, None),
+        (re.compile(r'def\s+\w+\(|class\s+\w+:|import\s+\w+').search, None),
+    ),
+    'html': (
+        (re.compile(r'<!DOCTYPE\s+html>', re.I).search, 1024),  # Doctype vem no início
+        (re.compile(r'<html').search, 2048),
+        (re.compile(r'<body').search, None),
+    ),
+    'javascript': (
+        (re.compile(r'function\s+\w+\(|const\s+\w+\s*=|let\s+\w+\s*=').search, None),
+    ),
+}
+
+# Linhas de enchimento descartadas na limpeza de respostas do chat
+_FILLER_PREFIXES = ('E aí', 'Você tem', 'Você está')
+# Linhas separadas por lote na limpeza: respostas longas não são divididas inteiras
+_LINE_BATCH = 100
+
+_CODE_CONTEXT_TERMS = tuple(re.compile(term) for term in (
+    r"crie um html", r"gere um site", r"desenvolva uma pagina",
+    r"template html", r"interface web"
+))
+
+
+@lru_cache(maxsize=256)
+def _is_code_request_cached(text_l):
+    """Núcleo puro (apenas regex) de _is_code_request, memoizado pelo texto em minúsculas."""
+    return _CODE_REQUEST_RE.search(text_l) is not None
+
+
+@lru_cache(maxsize=256)
+def _should_search_online_cached(msg_lower):
+    """Núcleo puro de _should_search_online, memoizado pelo texto em minúsculas."""
+    # Verifica indicadores de busca
+    if _SEARCH_INDICATORS_RE.search(msg_lower):
+        return True
+        
+    # Evita busca para comandos diretos
+    if any(cmd in msg_lower for cmd in _CMD_WORDS):
+        return False
+        
+    # Verifica se é uma pergunta
+    if '?' in msg_lower or any(w in msg_lower for w in _QUESTION_WORDS):
+        return True
+        
+    return False  # Por padrão, não busca
+
+
+@lru_cache(maxsize=256)
+def _detect_code_type_cached(msg_l):
+    """Detecção de linguagem baseada apenas no texto (sem contexto), memoizada."""
+    best = None
+    for match in _LANG_DETECT_RE.finditer(msg_l):
+        rank = _LANG_DETECT_RANK[match.lastgroup]
+        if rank == 0:
+            return 'python'  # Prioridade máxima, não há o que comparar
+        if best is None or rank < best:
+            best = rank
+    return _LANG_DETECT_RULES[best][1] if best is not None else None
+
+
+@lru_cache(maxsize=128)
+def _query_words(query_lower):
+    """Tokeniza a pergunta uma única vez (reaproveitado na tentativa de regeneração)."""
+    return frozenset(_WORD_RE.findall(query_lower))
+
+
+@lru_cache(maxsize=128)
+def _dynamic_temperature_cached(msg_l, topic, base_temp):
+    """Temperatura para (texto, tópico, base); pura, portanto memoizada."""
+    # Ajustes baseados no tipo de conteúdo
+    if any(w in msg_l for w in _CREATIVE_WORDS):
+        return base_temp + 0.25  # Mais criatividade
+    elif any(w in msg_l for w in _PRECISE_WORDS):
+        return max(0.1, base_temp - 0.3)  # Mais precisão
+    
+    # Ajustes baseados no contexto atual
+    if topic == 'programming':
+        return base_temp - 0.2  # Mais preciso para programação
+    elif topic == 'explanation':
+        return base_temp + 0.1  # Mais variado para explicações
+    
+    return base_temp
+
+
+@lru_cache(maxsize=128)
+def _lang_instr_cached(msg_l, programming):
+    """Monta as instruções de idioma/estilo para (texto, tópico de programação), memoizado."""
+    # Adiciona instruções específicas baseadas no contexto
+    core_instructions = _PROGRAMMING_INSTRUCTIONS if programming else _CORE_INSTRUCTIONS
+    
+    # Define idioma de forma natural
+    if _LANG_PT_RE.search(msg_l):
+        lang_instr = 'Comunique em português do Brasil de forma natural e direta.'
+    elif _LANG_ES_RE.search(msg_l):
+        lang_instr = 'Comunique en español de forma natural y directa.'
+    else:
+        lang_instr = 'Communicate naturally and directly in English.'
+        
+    # Monta instrução final
+    return f"{lang_instr}\n\n{core_instructions}\n\n"
+
+
+def _iter_lines(text, batch=_LINE_BATCH):
+    """Gera as linhas de text dividindo-o em lotes de até batch linhas."""
+    while True:
+        parts = text.split('\n', batch)
+        if len(parts) <= batch:
+            yield from parts
+            return
+        text = parts.pop()  # Restante ainda não dividido
+        yield from parts
+
 
 class IAAgentHybrid:
     def clear_prompt_cache(self, prompt):
         """Remove o cache de resposta para um prompt específico."""
         cache_key = self._sanitize_input(prompt).strip().lower()
-        if cache_key in self.response_cache:
-            del self.response_cache[cache_key]
-            self._save_cache_to_file()
+        with self._cache_lock:
+            for model_type, cache in self.response_cache.items():
+                if cache_key in cache:
+                    del cache[cache_key]
+                    self._schedule_cache_save(model_type)
     def health_check(self):
         """Verifica periodicamente se os modelos estão carregados e operacionais."""
-        import time
         status = {
-            'chat': self.models.get('chat') is not None,
-            'code': self.models.get('code') is not None,
+            'chat': self.is_model_ready('chat'),
+            'code': self.is_model_ready('code'),
             'last_check': time.time()
         }
         self._save_health_status(status)
@@ -27,21 +334,18 @@ class IAAgentHybrid:
 
     def _save_health_status(self, status):
         """Salva status de health-check em arquivo para consulta externa."""
-        health_path = os.path.join(os.path.dirname(__file__), '../assets/health_status.json')
         try:
-            with open(health_path, 'w', encoding='utf-8') as f:
-                import json
-                json.dump(status, f, ensure_ascii=False, indent=2)
+            with _HEALTH_PATH.open('wb') as f:
+                f.write(jsonutil.dumps(status, pretty=True))
         except Exception as e:
             print(f"[IAAgentHybrid] Falha ao salvar health-check: {e}")
     def _sanitize_input(self, msg):
         """Sanitiza o prompt do usuário para evitar comandos maliciosos e entradas perigosas."""
         # Remove comandos de sistema, scripts, tags perigosas e normaliza espaços
-        msg = re.sub(r'<script.*?>.*?</script>', '', msg, flags=re.IGNORECASE|re.DOTALL)
-        msg = re.sub(r'(rm\s+-rf|shutdown|format\s+|os\.system|subprocess|exec|eval|open\(|import\s+os|import\s+sys)', '[REMOVIDO]', msg, flags=re.IGNORECASE)
-        msg = re.sub(r'[\x00-\x1F\x7F]', '', msg)  # Remove caracteres de controle
-        msg = re.sub(r'\s+', ' ', msg).strip()
-        return msg
+        msg = _SANITIZE_SCRIPT_RE.sub('', msg)
+        msg = _SANITIZE_CMDS_RE.sub('[REMOVIDO]', msg)
+        msg = msg.translate(_CTRL_TABLE)  # Remove caracteres de controle
+        return ' '.join(msg.split())
     """
     IAAgentHybrid gerencia dois modelos locais (chat e código),
     respondendo perguntas e gerando código de forma contextualizada e humanizada.
@@ -54,19 +358,32 @@ class IAAgentHybrid:
         self.models['code'] = self._load_model(code_model_path, 'code')
         self.last_code = None
         
-        # Gerenciador de contexto e busca online
+        # Gerenciador de contexto; a busca online é carregada sob demanda
         self.context = ContextManager()
-        self.online_search = OnlineSearchManager()
+        self._online_search = None
         
         # Cache separado para chat e código
-        self.response_cache = {'chat': {}, 'code': {}}
+        self.response_cache = {'chat': OrderedDict(), 'code': OrderedDict()}
         self.cache_max_size = 50
+        # Índice de expiração: min-heap de (timestamp, chave) por tipo de cache
+        self._ttl_heap = {'chat': [], 'code': []}
         self.cache_file = {
-            'chat': os.path.join(os.path.dirname(__file__), '../assets/chat_cache.json'),
-            'code': os.path.join(os.path.dirname(__file__), '../assets/code_cache.json')
+            'chat': _ASSETS_DIR / 'chat_cache.json',
+            'code': _ASSETS_DIR / 'code_cache.json'
         }
+        # Garante (uma única vez) que o diretório assets existe
+        _ASSETS_DIR.mkdir(parents=True, exist_ok=True)
         self._load_cache_from_file()
         
+        # Escrita do cache em segundo plano, agrupando mutações próximas
+        self._cache_lock = threading.Lock()
+        self._cache_dirty = {'chat': False, 'code': False}
+        self._flush_event = threading.Event()
+        self._cache_write_lock = threading.Lock()  # Serializa flusher e flush de encerramento
+        self._cache_flush_delay = 2.0  # segundos de debounce (no máximo uma escrita a cada 2 s)
+        threading.Thread(target=self._cache_flusher, name="cache-flusher", daemon=True).start()
+        atexit.register(self._flush_now)
+        
         # Inicializar templates
         self.templates = CodeTemplates()
         
@@ -88,32 +405,118 @@ class IAAgentHybrid:
         
         # Configurações de busca online
         self.online_search_enabled = True  # Pode ser desativado se necessário
+    @property
+    def online_search(self):
+        """Gerenciador de busca online, importado e instanciado no primeiro uso."""
+        if self._online_search is None:
+            from ai.online_search import OnlineSearchManager  # Import pesado (clientes HTTP)
+            self._online_search = OnlineSearchManager()
+        return self._online_search
+
     def _load_cache_from_file(self):
         """Carrega cache de respostas do arquivo JSON, se existir."""
         try:
             for model_type in ['chat', 'code']:
                 cache_file = self.cache_file[model_type]
-                if os.path.exists(cache_file):
-                    with open(cache_file, 'r', encoding='utf-8') as f:
-                        self.response_cache[model_type] = json.load(f)
+                if cache_file.exists():
+                    with cache_file.open('rb') as f:
+                        cache = OrderedDict(jsonutil.loads(f.read()))
+                    # Respeita o limite mesmo para arquivos antigos maiores
+                    while len(cache) > self.cache_max_size:
+                        cache.popitem(last=False)
+                    self.response_cache[model_type] = cache
+                    self._rebuild_ttl_index(model_type)
         except Exception as e:
             print(f"[IAAgentHybrid] Falha ao carregar cache: {e}")
-            self.response_cache = {'chat': {}, 'code': {}}
+            self.response_cache = {'chat': OrderedDict(), 'code': OrderedDict()}
+            self._ttl_heap = {'chat': [], 'code': []}
+
+    def _rebuild_ttl_index(self, model_type):
+        """Reconstrói o heap de expiração a partir das entradas atuais do cache."""
+        heap = [(entry.get('timestamp', 0), key) for key, entry in self.response_cache[model_type].items()]
+        heapq.heapify(heap)
+        self._ttl_heap[model_type] = heap
+
+    def _evict_expired(self, model_type, now):
+        """Remove entradas vencidas olhando apenas o topo do heap (O(log N) por remoção)."""
+        cache = self.response_cache[model_type]
+        heap = self._ttl_heap[model_type]
+        while heap and now - heap[0][0] >= _CACHE_TTL:
+            timestamp, key = heapq.heappop(heap)
+            entry = cache.get(key)
+            # Ignora itens obsoletos do heap (chave regravada ou já descartada pelo LRU)
+            if entry is not None and entry.get('timestamp', 0) == timestamp:
+                del cache[key]
+
+    def _cache_get(self, model_type, key):
+        """Retorna a entrada do cache (marcando-a como recente) ou None se ausente/expirada."""
+        with self._cache_lock:
+            cache = self.response_cache[model_type]
+            entry = cache.get(key)
+            if entry is None:
+                return None
+            if time.time() - entry.get('timestamp', 0) >= _CACHE_TTL:
+                del cache[key]
+                self._schedule_cache_save(model_type)
+                return None
+            cache.move_to_end(key)
+            return entry
+
+    def _cache_put(self, model_type, key, value):
+        """Insere resposta no cache LRU, descartando as entradas menos recentes acima do limite."""
+        with self._cache_lock:
+            now = time.time()
+            self._evict_expired(model_type, now)
+            cache = self.response_cache[model_type]
+            cache[key] = {
+                'response': value,
+                'timestamp': now
+            }
+            cache.move_to_end(key)
+            heapq.heappush(self._ttl_heap[model_type], (now, key))
+            while len(cache) > self.cache_max_size:
+                cache.popitem(last=False)
+            # Itens obsoletos acumulam no heap; compacta quando passa do dobro do cache
+            if len(self._ttl_heap[model_type]) > 2 * self.cache_max_size:
+                self._rebuild_ttl_index(model_type)
+            self._schedule_cache_save(model_type)
+
+    def _schedule_cache_save(self, model_type):
+        """Marca o cache como alterado; a escrita ocorre na thread de flush."""
+        self._cache_dirty[model_type] = True
+        self._flush_event.set()
+
+    def _cache_flusher(self):
+        """Thread de fundo: aguarda mutações e grava os caches alterados com debounce."""
+        while True:
+            self._flush_event.wait()
+            time.sleep(self._cache_flush_delay)  # Agrupa mutações em sequência
+            self._flush_event.clear()
+            self._save_cache_to_file()
+
+    def _flush_now(self):
+        """Grava imediatamente os caches pendentes (usado no encerramento)."""
+        self._save_cache_to_file()
 
     def _save_cache_to_file(self):
-        """Salva cache de respostas no arquivo JSON."""
-        try:
-            # Garante que o diretório assets existe
-            assets_dir = os.path.join(os.path.dirname(__file__), '../assets')
-            os.makedirs(assets_dir, exist_ok=True)
-            
-            # Salva cada tipo de cache separadamente
-            for model_type in ['chat', 'code']:
-                cache_file = self.cache_file[model_type]
-                with open(cache_file, 'w', encoding='utf-8') as f:
-                    json.dump(self.response_cache[model_type], f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"[IAAgentHybrid] Falha ao salvar cache: {e}")
+        """Salva no arquivo JSON apenas os caches de resposta alterados."""
+        with self._cache_lock:
+            pending = {}
+            for model_type, dirty in self._cache_dirty.items():
+                if dirty:
+                    pending[model_type] = dict(self.response_cache[model_type])
+                    self._cache_dirty[model_type] = False
+        
+        with self._cache_write_lock:
+            for model_type, snapshot in pending.items():
+                try:
+                    # Escrita atômica: arquivo temporário + rename
+                    cache_file = self.cache_file[model_type]
+                    tmp_file = cache_file.with_suffix('.tmp')
+                    tmp_file.write_bytes(jsonutil.dumps(snapshot, pretty=True))
+                    tmp_file.replace(cache_file)
+                except Exception as e:
+                    print(f"[IAAgentHybrid] Falha ao salvar cache: {e}")
 
     def _load_model(self, path, tag):
         """Carrega um modelo gguf com otimizações."""
@@ -126,159 +529,82 @@ class IAAgentHybrid:
             logger.error(f"Erro ao carregar modelo '{tag}': {e}")
             return None
 
-    def _get_dynamic_temperature(self, msg):
-        """Determina a temperatura ideal baseado no contexto e tipo de pergunta."""
-        msg_l = msg.lower()
-        base_temp = self.model_params['chat']['base_temp']
-        
-        # Ajustes baseados no tipo de conteúdo
-        if any(w in msg_l for w in ["criativo", "imagine", "crie", "desenhe", "design"]):
-            return base_temp + 0.25  # Mais criatividade
-        elif any(w in msg_l for w in ["exato", "preciso", "técnico", "específico"]):
-            return max(0.1, base_temp - 0.3)  # Mais precisão
-        
-        # Ajustes baseados no contexto atual
-        if self.context.current_context['topic'] == 'programming':
-            return base_temp - 0.2  # Mais preciso para programação
-        elif self.context.current_context['topic'] == 'explanation':
-            return base_temp + 0.1  # Mais variado para explicações
-        
-        return base_temp
+    def _ready_model(self, tag):
+        """Retorna o modelo após o aquecimento; descarta-o se a inferência teste falhou."""
+        model = self.models.get(tag)
+        if model and not wait_until_warm(model):
+            logger.error(f"Modelo '{tag}' falhou na inferência teste e foi descartado")
+            self.models[tag] = model = None
+        return model
+
+    def is_model_ready(self, tag):
+        """Modelo carregado e com a inferência teste concluída com sucesso (não bloqueia)."""
+        model = self.models.get(tag)
+        if model is None:
+            return False
+        event = getattr(model, '_warm_event', None)
+        if event is not None and not event.is_set():
+            return False  # Ainda aquecendo em segundo plano
+        return self._ready_model(tag) is not None  # Descarta o modelo se o teste falhou
+
+    def _get_dynamic_temperature(self, msg_lower, topic):
+        """Determina a temperatura ideal baseado no tópico atual e tipo de pergunta (texto já em minúsculas)."""
+        return _dynamic_temperature_cached(msg_lower, topic, self.model_params['chat']['base_temp'])
 
     def _is_valid_response(self, response, query):
         """Verifica se a resposta é técnica e relevante."""
         if not response:
             return False
             
-        response_lower = response.lower()
         query_lower = query.lower()
         
-        # Padrões que indicam respostas problemáticas
-        problematic_patterns = [
-            # Respostas evasivas ou vazias
-            r"não (sei|entendi|posso)",
-            r"desculpe, mas não",
-            r"não tenho certeza",
-            # Fingindo experiências
-            r"quando (eu|nós) (usei|fiz)",
-            r"na minha vida",
-            r"minha experiência pessoal",
-            # Extremamente genérico
-            r"^é importante$",
-            r"^existem várias$",
-            r"^depende$",
-            # Robótico demais
-            r"^processando sua solicitação$",
-            r"^conforme solicitado$",
-            r"^executando comando$"
-        ]
-        
-        # Checa padrões problemáticos
-        for pattern in problematic_patterns:
-            if re.search(pattern, response_lower):
-                return False
-                
-        # Verifica comprimento mínimo contextual
+        # Verifica comprimento mínimo contextual (depende só da pergunta)
         min_length = 50  # Base
         if '?' in query:
             min_length = 100  # Perguntas precisam mais detalhe
-        if any(w in query_lower for w in ['explique', 'detalhe', 'como']):
+        if any(w in query_lower for w in _DETAIL_WORDS):
             min_length = 150  # Explicações precisam ainda mais
             
         if len(response) < min_length:
             return False
             
+        # Só o prefixo da resposta é analisado (evita varrer respostas longas inteiras)
+        response_lower = response[:_RELEVANCE_SCAN_LIMIT].lower()
+        
+        # Checa padrões problemáticos (união pré-compilada, uma única varredura)
+        if _PROBLEMATIC_RE.search(response_lower, 0, _PROBLEMATIC_SCAN_LIMIT):
+            return False
+            
         # Verifica relevância ao tópico
-        query_words = set(re.findall(r'\w+', query_lower))
-        response_words = set(re.findall(r'\w+', response_lower))
-        relevance = len(query_words & response_words) / len(query_words)
+        query_words = _query_words(query_lower)
+        if not query_words:
+            return True  # Sem palavras na pergunta, não há como medir relevância
+        matched = query_words.intersection(_WORD_RE.findall(response_lower))
+        relevance = len(matched) / len(query_words)
         
         if relevance < 0.3:  # Menos de 30% das palavras da pergunta aparecem na resposta
             return False
             
         return True
 
-    def _should_search_online(self, msg: str) -> bool:
-        """Determina se deve realizar busca online baseado na mensagem."""
-        msg_lower = msg.lower()
-        
-        # Palavras-chave que indicam necessidade de informação atual
-        search_indicators = [
-            'como funciona',
-            'o que é',
-            'explique',
-            'me fale sobre',
-            'qual',
-            'quando',
-            'onde',
-            'por que',
-            'documentação',
-            'exemplo de',
-            'tutorial',
-            'erro',
-            'problema com',
-            'versão atual',
-            'última versão',
-            'api',
-            'biblioteca',
-            'framework'
-        ]
-        
-        # Verifica indicadores de busca
-        if any(indicator in msg_lower for indicator in search_indicators):
-            return True
-            
-        # Evita busca para comandos diretos
-        if any(cmd in msg_lower for cmd in ['gere', 'crie', 'faça', 'mostre']):
-            return False
-            
-        # Verifica se é uma pergunta
-        if '?' in msg or any(w in msg_lower for w in ['como', 'qual', 'quando', 'onde', 'por que']):
-            return True
-            
-        return False  # Por padrão, não busca
+    def _should_search_online(self, msg_lower: str) -> bool:
+        """Determina se deve realizar busca online baseado na mensagem (já em minúsculas)."""
+        return _should_search_online_cached(msg_lower)
 
-    def _detect_code_type(self, msg):
-        """Detecta o tipo de código solicitado na mensagem e contexto."""
-        msg_l = msg.lower()
+    def _detect_code_type(self, msg_l):
+        """Detecta o tipo de código solicitado na mensagem (já em minúsculas) e contexto."""
         
         # Primeiro checa o contexto atual
-        if self.context.current_context.get('last_code_type'):
+        last_code_type = self.context.current_context.get('last_code_type')
+        if last_code_type:
             # Se a mensagem parece ser continuação
-            if any(w in msg_l for w in ['continue', 'adicione', 'modifique', 'melhore']):
-                return self.context.current_context['last_code_type']
-        
-        # Detecção avançada de Python
-        python_patterns = [
-            r'python|\.py|script python',  # Menções diretas
-            r'input\s*\(|print\s*\(',      # Funções comuns
-            r'def\s+\w+|class\s+\w+',     # Definições
-            r'while\s+|for\s+in',         # Loops
-            r'if\s+.*:|else\s*:',         # Condicionais
-            r'import\s+\w+',              # Imports
-            r'lista|dicionário|tupla',    # Tipos de dados
-            r'variável|função|método',     # Termos em português
-            r'calcul|loop|repet',         # Conceitos gerais
-            r'tabuada|número|soma'        # Termos matemáticos
-        ]
-        if any(re.search(pattern, msg_l) for pattern in python_patterns):
-            return 'python'
-            
-        # Outras linguagens
-        elif re.search(r'javascript|js|node|\.js', msg_l):
-            return 'javascript'
-        elif re.search(r'html|página|site|blog|css', msg_l):
-            return 'html'
-        elif re.search(r'java|\.java|classe|public class', msg_l):
-            return 'java'
-        elif re.search(r'c\+\+|cpp|\.cpp', msg_l):
-            return 'cpp'
+            if any(w in msg_l for w in _CONTINUATION_WORDS):
+                return last_code_type
         
-        # Análise de contexto geral
-        elif re.search(r'função|def|return|print', msg_l):
-            return 'python'  # Default para funções simples
-        elif re.search(r'página|estilo|layout|design', msg_l):
-            return 'html'    # Default para conteúdo web
+        # Detecção por palavras-chave e padrões (memoizada por texto)
+        code_type = _detect_code_type_cached(msg_l)
+        if code_type:
+            return code_type
             
         # Usa o contexto de código anterior
         code_context = self.context.get_code_context()
@@ -292,59 +618,34 @@ class IAAgentHybrid:
         
         return None  # Não foi possível detectar
 
-    def _detect_lang_instr(self, msg):
-        """Gera instruções inteligentes para o modelo, equilibrando técnico e natural."""
-        msg_l = msg.lower()
-        
-        # Instruções para respostas naturais e precisas
-        core_instructions = [
-            "Mantenha um tom conversacional natural.",
-            "Seja preciso e direto nas respostas.",
-            "Use linguagem clara e acessível.",
-            "Evite formalidades ou prefixos desnecessários.",
-            "Seja objetivo mas mantenha empatia.",
-            "Comunique com entusiasmo genuíno."
-        ]
-        
-        # Adiciona instruções específicas baseadas no contexto
-        if self.context.current_context.get('topic') == 'programming':
-            core_instructions.extend([
-                "Foque em explicações técnicas e código.",
-                "Use exemplos específicos e práticos.",
-                "Cite fontes técnicas quando relevante."
-            ])
-        
-        # Define idioma de forma natural
-        if re.search(r'[ãêõçáéíóúâêôà]|você|exemplo|código|explicação', msg_l):
-            lang_instr = 'Comunique em português do Brasil de forma natural e direta.'
-        elif re.search(r'[ñáéíóú]|usted|código|ejemplo|explicar', msg_l):
-            lang_instr = 'Comunique en español de forma natural y directa.'
-        else:
-            lang_instr = 'Communicate naturally and directly in English.'
-            
-        # Monta instrução final
-        return f"{lang_instr}\n\n" + "\n".join(core_instructions) + "\n\n"
+    def _detect_lang_instr(self, msg_lower, topic):
+        """Gera instruções inteligentes para o modelo, equilibrando técnico e natural (texto já em minúsculas)."""
+        return _lang_instr_cached(msg_lower, topic == 'programming')
 
     def reply_chat(self, msg, force_new=False):
         """Responde a um prompt do usuário, usando contexto e ambos os modelos de forma inteligente."""
-        import logging, time
-        logger = logging.getLogger("hybrid_ide_api")
+        logger = _API_LOGGER
         
         # Sanitizar entrada
         clean_msg = self._sanitize_input(msg)
-        cache_key = clean_msg.strip().lower()
+        clean_lower = clean_msg.lower()  # Calculado uma vez e repassado aos detectores
+        cache_key = clean_lower
         
         # Adiciona mensagem ao contexto
         self.context.add_message('user', clean_msg)
         
         # Verificar se é pedido de código
-        is_code_request = self._is_code_request(msg)
+        # (detecção de código usa a mensagem original, antes da sanitização)
+        msg_lower = msg.lower()
+        is_code_request = self._is_code_request(msg_lower)
+        
+        # Prompts curtos (saudações, confirmações) pulam busca online, ajustes e regeneração
+        is_short = not is_code_request and len(clean_msg) < _SHORT_PROMPT_LEN
         
         # Se não for pedido de código e não forçar novo, tenta cache
-        if not is_code_request and not force_new and cache_key in self.response_cache['chat']:
-            cached = self.response_cache['chat'][cache_key]
-            # Verificar TTL do cache (24 horas para chat)
-            if time.time() - cached.get('timestamp', 0) < 24 * 3600:
+        if not is_code_request and not force_new:
+            cached = self._cache_get('chat', cache_key)  # Já descarta entradas expiradas (24h)
+            if cached:
                 response = cached['response']
                 self.context.add_message('assistant', response[0] if isinstance(response, tuple) else response)
                 logger.info(f"[IAAgentHybrid] Usando resposta em cache para chat: '{clean_msg[:50]}...'")
@@ -352,50 +653,63 @@ class IAAgentHybrid:
         
         logger.info(f"[IAAgentHybrid] Gerando nova resposta para: '{clean_msg[:50]}...'")
         
-        if not self.models['chat']:
+        if not self._ready_model('chat'):
             return "Erro: modelo de chat não disponível.", None
             
         try:
-            # Construir prompt com contexto
+            # Construir prompt com contexto (snapshot único do contexto atual)
+            ctx = self.context.current_context
+            topic = ctx.get('topic')
             context_prompt = self.context.get_context_prompt()
-            lang_instr = self._detect_lang_instr(clean_msg)
+            lang_instr = self._detect_lang_instr(clean_lower, topic)
             
             # Enriquecer com busca online se apropriado
             online_info = ""
-            if self.online_search_enabled and self._should_search_online(clean_msg):
+            if not is_short and self.online_search_enabled and self._should_search_online(clean_lower):
                 try:
                     enriched_data = self.online_search.enrich_response(
                         clean_msg,
-                        self.context.current_context
+                        ctx
                     )
                     online_info = self.online_search.format_enriched_data(enriched_data)
                 except Exception as e:
                     logger.warning(f"Erro na busca online: {e}")
             
             # Prompt principal com contexto e informações online
-            main_prompt = f"{lang_instr}\n\n{context_prompt}\n\n{online_info}\n\nPergunta atual: {clean_msg.strip()}"
+            # (join aloca o texto final uma única vez; clean_msg já vem sem espaços nas pontas)
+            prompt_parts = [lang_instr, "\n\n", context_prompt]
+            if online_info:
+                prompt_parts += ("\n\n", online_info)
+            prompt_parts += ("\n\nPergunta atual: ", clean_msg)
+            main_prompt = "".join(prompt_parts)
             
-            # Ajuste dinâmico de temperatura baseado em contexto
-            temp = self._get_dynamic_temperature(clean_msg)
-            
-            # Ajuste inteligente de tokens baseado na capacidade real do modelo
             params = self.model_params['chat']
-            context_length = params['context_length']
-            max_available = context_length - len(main_prompt)  # Tokens disponíveis após prompt
-            
-            # Define tokens base considerando o espaço disponível
-            base_tokens = min(params['max_tokens'], max_available * 0.75)  # Usa 75% do espaço disponível
-            
-            # Ajustes por tipo de pergunta (limitados ao disponível)
-            if len(context_prompt) > 500:  # Contexto longo
-                base_tokens = min(base_tokens * 1.3, max_available * 0.85)
-            if len(clean_msg.split()) > 20:  # Perguntas complexas
-                base_tokens = min(base_tokens * 1.2, max_available * 0.85)
-            if any(w in clean_msg.lower() for w in ['explique', 'detalhe', 'descreva', 'como', 'exemplo']):
-                base_tokens = min(base_tokens * 1.15, max_available * 0.85)
+            if is_short:
+                # Caminho rápido: respostas curtas não precisam de ajuste fino
+                temp = params['base_temp']
+                max_tokens = params['min_tokens'] * 2
+            else:
+                # Ajuste dinâmico de temperatura baseado em contexto
+                temp = self._get_dynamic_temperature(clean_lower, topic)
+                
+                # Ajuste inteligente de tokens baseado na capacidade real do modelo
+                context_length = params['context_length']
+                max_available = context_length - len(main_prompt)  # Tokens disponíveis após prompt
+                
+                # Define tokens base considerando o espaço disponível (aritmética inteira)
+                base_tokens = min(params['max_tokens'], (max_available * 3) >> 2)  # Usa 75% do espaço disponível
+                adjusted_cap = (max_available * 17) // 20  # 85% do espaço disponível
                 
-            # Garante tokens mínimos e máximos seguros
-            max_tokens = max(params['min_tokens'], min(int(base_tokens), max_available))
+                # Ajustes por tipo de pergunta (limitados ao disponível)
+                if len(context_prompt) > 500:  # Contexto longo: +30%
+                    base_tokens = min((base_tokens * 13) // 10, adjusted_cap)
+                if len(clean_msg.split()) > 20:  # Perguntas complexas: +20%
+                    base_tokens = min((base_tokens * 6) // 5, adjusted_cap)
+                if any(w in clean_lower for w in _EXPLAIN_WORDS):  # Explicações: +15%
+                    base_tokens = min((base_tokens * 23) // 20, adjusted_cap)
+                    
+                # Garante tokens mínimos e máximos seguros
+                max_tokens = max(params['min_tokens'], min(base_tokens, max_available))
             
             # Configuração otimizada usando limites reais do modelo
             generation_config = {
@@ -418,8 +732,8 @@ class IAAgentHybrid:
             if len(chat_resp) > 50:  # Aumentado threshold
                 chat_resp = self._clean_duplicate_response(chat_resp, msg)
             
-            # Análise da qualidade da resposta
-            if not self._is_valid_response(chat_resp, clean_msg):
+            # Análise da qualidade da resposta (heurística pensada para respostas longas)
+            if not is_short and not self._is_valid_response(chat_resp, clean_msg):
                 logger.warning(f"[IAAgentHybrid] Resposta pode não ser adequada, tentando regenerar...")
                 # Tenta uma vez com temperatura diferente
                 out = self.models['chat'](main_prompt, max_tokens=max_tokens, temperature=temp + 0.2)
@@ -427,7 +741,7 @@ class IAAgentHybrid:
             
             if not chat_resp:
                 logger.warning(f"[IAAgentHybrid] Resposta do modelo de chat veio vazia para: '{msg}'")
-            elif not self._is_code_request(msg):  # Só adiciona ao contexto se não for pedido de código
+            elif not is_code_request:  # Só adiciona ao contexto se não for pedido de código
                 self.context.add_message('assistant', chat_resp)
                 
         except Exception as e:
@@ -436,13 +750,14 @@ class IAAgentHybrid:
 
         code_prompt = None
         code_result = None
+        code_type = None  # Definido apenas para pedidos de código
         
         # Se for pedido de código, usa o chat para estruturar o pedido
-        if self._is_code_request(msg):
+        if is_code_request:
             logger.info(f"[IAAgentHybrid] Pedido de código DETECTADO para: '{msg}'")
             
             # Detecta o tipo de código solicitado
-            code_type = self._detect_code_type(msg)
+            code_type = self._detect_code_type(msg_lower)
             if not code_type:
                 code_type = 'html'  # Fallback, mas vamos logar
                 logger.warning(f"[IAAgentHybrid] Tipo de código não detectado, usando HTML como fallback para: '{msg}'")
@@ -478,24 +793,8 @@ Responda apenas com o pedido estruturado, sem explicações adicionais."""
             code_context = self.context.get_code_context() or ""
             
             # Gera prompt específico para o tipo de código
-            code_prompts = {
-                'python': f"""Escreva apenas o código Python para: {msg.strip()}
-
-O código deve:
-- Ser funcional e pronto para executar
-- Incluir tratamento de erros básico
-- Ter comentários explicativos
-- Seguir PEP 8
-- Não ter cabeçalhos ou docstrings desnecessários
-
-{code_context if code_context else ''}""",
-                'javascript': f"Gere exclusivamente código JavaScript funcional e completo para:\n{msg.strip()}\n{code_context}",
-                'html': f"Gere exclusivamente código HTML/CSS funcional e completo para:\n{msg.strip()}\n{code_context}",
-                'java': f"Gere exclusivamente código Java funcional e completo para:\n{msg.strip()}\n{code_context}",
-                'cpp': f"Gere exclusivamente código C++ funcional e completo para:\n{msg.strip()}\n{code_context}"
-            }
-            
-            code_prompt = code_prompts.get(code_type, code_prompts['html'])
+            template = _CODE_PROMPT_TEMPLATES.get(code_type, _CODE_PROMPT_TEMPLATES['html'])
+            code_prompt = template.format(msg=msg.strip(), code_context=code_context)
             
             # Gera código com contexto do tipo
             code_result = self._generate_code(code_prompt, code_type)
@@ -515,44 +814,27 @@ O código deve:
             chat_resp = "Pode detalhar um pouco mais o que você precisa?"
         
         # CACHE DESATIVADO TEMPORARIAMENTE
-        result = (chat_resp, self.last_code if is_code_request else None, code_type if is_code_request else None)
+        # last_code e code_type já são None quando não é pedido de código
+        result = (chat_resp, self.last_code, code_type)
         return result
 
-    def _is_code_request(self, prompt):
-        """Detecta qualquer pedido de geração de código, HTML, CSS, frontend, etc. Muito tolerante."""
-        terms = [
-            # Português e inglês
-            r"html", r"css", r"div", r"body", r"head", r"form", r"input", r"campo", r"tabela", r"table", r"style", r"layout", r"visual", r"página", r"pagina", r"exiba", r"exibir", r"mostre", r"mostrar", r"botão", r"botao", r"button",
-            r"crie", r"faça", r"faça um", r"faça uma", r"faça o", r"faça a", r"código", r"código para", r"exemplo de código", r"script", r"programa", r"implemente", r"front", r"frontend", r"python", r"javascript", r"js", r"json", r"salvar como", r"template", r"arquivo ",
-            r"escreva", r"gere", r"demonstre", r"complete o código", r"monte um", r"criar um código", r"criar um html", r"desenvolva", r"interface", r"interface web", r"em html", r"em js", r"em css",
-            # Inglês (para pegar de tudo)
-            r"code", r"generate an html", r"create an html", r"show code", r"display code", r"create a form", r"make an html", r"generate code", r"script in python", r"script in js", r"script in html",
-        ]
-        texto = prompt.lower()
-        for term in terms:
-            if re.search(term, texto):
-                return True
-        return False
+    def _is_code_request(self, prompt_lower):
+        """Detecta qualquer pedido de geração de código, HTML, CSS, frontend, etc. Muito tolerante (texto já em minúsculas)."""
+        return _is_code_request_cached(prompt_lower)
 
     def _extract_code_prompt(self, chat_resp, prompt):
         """Extrai contexto do usuário para geração mais precisa de código."""
         # Extrair contexto mais específico para geração de código
-        code_context_terms = [
-            r"crie um html", r"gere um site", r"desenvolva uma pagina",
-            r"template html", r"interface web"
-        ]
-        for term in code_context_terms:
-            match = re.search(term, prompt.lower())
+        prompt_l = prompt.lower()
+        for term in _CODE_CONTEXT_TERMS:
+            match = term.search(prompt_l)
             if match:
                 return prompt[match.start():].strip()
         return prompt.strip()
 
     def _generate_code(self, code_prompt, lang_type=None):
         """Gera código a partir do prompt usando o modelo code com estratégias avançadas e validações rígidas."""
-        import logging
-        logger = logging.getLogger("hybrid_ide_ai")
-        
-        if not self.models['code']:
+        if not self._ready_model('code'):
             logger.error("[IAAgentHybrid] Modelo de código não disponível")
             return None
             
@@ -561,27 +843,9 @@ O código deve:
             logger.debug(f"Gerando código para linguagem: {lang_type}")
             logger.debug(f"Prompt de geração: {code_prompt[:500]}...")  # Limita log para não sobrecarregar
             
-            # Exemplos de código mais contextuais e abrangentes
-            language_examples = {
-                'python': {
-                    'basic': 'def calcular_media(numeros):\n    return sum(numeros) / len(numeros) if numeros else 0',
-                    'advanced': 'class GerenciadorTarefas:\n    def __init__(self):\n        self.tarefas = []\n    \n    def adicionar_tarefa(self, tarefa):\n        self.tarefas.append({"descricao": tarefa, "concluida": False})\n    \n    def listar_tarefas(self):\n        return [t["descricao"] for t in self.tarefas]\n',
-                    'error_handling': 'def dividir(a, b):\n    try:\n        return a / b\n    except ZeroDivisionError:\n        return "Erro: Divisão por zero não permitida"\n'
-                },
-                'javascript': {
-                    'basic': 'function gerarNumeroAleatorio(min, max) {\n    return Math.floor(Math.random() * (max - min + 1)) + min;\n}',
-                    'advanced': 'class GerenciadorEstado {\n    constructor() {\n        this.estado = {};\n    }\n\n    definirEstado(chave, valor) {\n        this.estado[chave] = valor;\n    }\n\n    obterEstado(chave) {\n        return this.estado[chave];\n    }\n}',
-                    'async': 'async function buscarDadosAPI(url) {\n    try {\n        const resposta = await fetch(url);\n        return await resposta.json();\n    } catch (erro) {\n        console.error("Erro na busca:", erro);\n        return null;\n    }\n'
-                },
-                'html': {
-                    'basic': '<!DOCTYPE html>\n<html lang="pt-BR">\n<head>\n    <meta charset="UTF-8">\n    <title>Página Simples</title>\n</head>\n<body>\n    <h1>Olá, Mundo!</h1>\n</body>\n</html>',
-                    'form': '<!DOCTYPE html>\n<html lang="pt-BR">\n<head>\n    <meta charset="UTF-8">\n    <title>Formulário de Contato</title>\n    <style>\n        body { font-family: Arial, sans-serif; max-width: 400px; margin: 0 auto; }\n        input, textarea { width: 100%; margin: 10px 0; }\n    </style>\n</head>\n<body>\n    <form>\n        <input type="text" placeholder="Nome" required>\n        <input type="email" placeholder="E-mail" required>\n        <textarea placeholder="Sua mensagem" required></textarea>\n        <button type="submit">Enviar</button>\n    </form>\n</body>\n</html>'
-                }
-            }
-            
             # Seleção dinâmica de exemplo baseado no contexto
             example_type = 'advanced' if len(code_prompt) > 100 else 'basic'
-            example = language_examples.get(lang_type, {}).get(example_type, '')
+            example = _LANGUAGE_EXAMPLES.get(lang_type, {}).get(example_type, '')
             
             # Prompt de geração refinado
             pure_code_prompt = f"""Gere código {lang_type or 'html'} seguindo RIGOROSAMENTE estas diretrizes:
@@ -599,15 +863,7 @@ REGRAS ABSOLUTAS:
 Gere APENAS o código, sem explicações, markdown ou prefixos."""
             
             # Parâmetros de geração otimizados
-            code_stops = {
-                'python': ['\ndef ', '```', '###', '\n# ', '\nclass '],
-                'html': ['</html>', '```', '<!----', '<!--', '</body>'],
-                'javascript': ['\nfunction ', '```', '//', '/*', '\nconst ', '\nlet '],
-                'java': ['\npublic ', '```', '//'],
-                'cpp': ['\n#include ', '```', '//']
-            }
-            
-            stops = code_stops.get(lang_type or 'html', ['```'])
+            stops = _CODE_STOPS.get(lang_type or 'html', _DEFAULT_CODE_STOPS)
             gen_params = get_optimal_generation_params('code', len(pure_code_prompt))
             gen_params['max_tokens'] = 1024
             gen_params['stop'] = stops
@@ -636,28 +892,10 @@ Gere APENAS o código, sem explicações, markdown ou prefixos."""
                     logger.warning(f"Código repetitivo para {lang_type}")
                     return False
                 
-                # Verificações específicas por linguagem
-                checks_by_language = {
-                    'python': [
-                        re.search(r'def\s+\w+\(', code) or 
-                        re.search(r'class\s+\w+:', code) or 
-                        re.search(r'import\s+\w+', code)
-                    ],
-                    'html': [
-                        re.search(r'<!DOCTYPE\s+html>', code, re.I),
-                        re.search(r'<html', code),
-                        re.search(r'<body', code)
-                    ],
-                    'javascript': [
-                        re.search(r'function\s+\w+\(', code) or 
-                        re.search(r'const\s+\w+\s*=', code) or 
-                        re.search(r'let\s+\w+\s*=', code)
-                    ]
-                }
-                
-                language_checks = checks_by_language.get(lang_type, [])
+                # Verificações específicas por linguagem (padrões pré-compilados)
+                language_checks = _CODE_CHECKS.get(lang_type, ())
                 
-                if not all(language_checks):
+                if not all(check(code if limit is None else code[:limit]) for check, limit in language_checks):
                     logger.warning(f"Código não passou nas verificações para {lang_type}")
                     return False
                 
@@ -677,26 +915,25 @@ Gere APENAS o código, sem explicações, markdown ou prefixos."""
 
     def _clean_duplicate_response(self, text, original_msg=None):
         """Limpa respostas duplicadas ou repetitivas da IA para maior naturalidade."""
-        # Limpeza simples e eficaz
-        lines = text.split('\n')
+        # Passada única: descarta curtas, repetidas e de enchimento; para na 3ª linha aceita
         cleaned_lines = []
         seen = set()
         
-        for line in lines:
+        for line in _iter_lines(text):
             line = line.strip()
-            if line and line not in seen and len(line) > 5:
-                # Evita repetições e loops
-                if not re.search(r'^(E aí|Você tem|Você está).*', line):
-                    cleaned_lines.append(line)
-                    seen.add(line)
+            if len(line) > 5 and line not in seen and not line.startswith(_FILLER_PREFIXES):
+                cleaned_lines.append(line)
+                seen.add(line)
+                # Limita a 3 linhas para evitar loops
+                if len(cleaned_lines) == 3:
+                    break
         
-        # Limita a 3 linhas para evitar loops
-        result = '\n'.join(cleaned_lines[:3])
+        result = '\n'.join(cleaned_lines)
         
-        # Se resposta muito estranha, limpa mais
-        if len(result) < 10 or re.search(r'[E aí|Você tem|Você está].*[E aí|Você tem|Você está]', result):
+        # Se sobrou quase nada, volta às primeiras linhas originais
+        if len(result) < 10:
             # Remove linhas problemáticas e pega só as primeiras
-            clean_lines = [line for line in lines[:2] if line.strip() and len(line.strip()) > 5]
+            clean_lines = [line for line in text.split('\n', 2)[:2] if line.strip() and len(line.strip()) > 5]
             result = '\n'.join(clean_lines) if clean_lines else result
         
         return result
@@ -707,27 +944,5 @@ Gere APENAS o código, sem explicações, markdown ou prefixos."""
         if self._is_code_request(key):
             return
             
-        current_time = time.time()
-        expired_keys = []
-        
-        # Remove entradas de chat expiradas (24 horas)
-        for k, v in self.response_cache.items():
-            if current_time - v.get('timestamp', 0) > 24 * 3600:
-                expired_keys.append(k)
-                
-        for k in expired_keys:
-            del self.response_cache[k]
-            
-        # Se cache estiver cheio, remove o mais antigo
-        if len(self.response_cache) >= self.cache_max_size:
-            oldest_key = min(self.response_cache.keys(), 
-                           key=lambda k: self.response_cache[k].get('timestamp', 0))
-            del self.response_cache[oldest_key]
-            
-        # Adiciona apenas respostas de chat no cache
-        self.response_cache[key] = {
-            'response': value,
-            'timestamp': current_time
-        }
-        
-        self._save_cache_to_file()
+        # LRU limitado a cache_max_size; entradas expiradas caem no _cache_get
+        self._cache_put('chat', key, value)
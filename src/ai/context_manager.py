@@ -3,16 +3,83 @@ Gerenciador de contexto avançado para o sistema híbrido de IA.
 Mantém e analisa histórico de conversas, contexto de código e preferências
 para melhorar a qualidade das respostas dos modelos.
 """
-import json
+import atexit
+import copy
 import os
-from typing import List, Dict, Optional, Union
+import queue
+import threading
+import time
+from collections import deque
+from itertools import islice
+from typing import Deque, List, Dict, Optional, Union
 import re
 from datetime import datetime
 
+import jsonutil
+
+# Tópicos em ordem de prioridade: (tópico, padrão)
+_TOPIC_RULES = (
+    ('programming', r'código|programa|desenvolv|implement|bug|error|debug'),
+    ('explanation', r'explique|como|qual|por que|defin|conceito'),
+    ('help', r'ajuda|erro|problema|não consigo|falha'),
+    ('testing', r'teste|validar|verificar|assert|spec'),
+)
+# Lookahead com grupos nomeados: uma varredura vê todos os tópicos presentes
+# e o de maior prioridade vence, como na antiga cascata de re.search
+_TOPIC_RE = re.compile('(?=' + '|'.join(f'(?P<{topic}>{pattern})' for topic, pattern in _TOPIC_RULES) + ')')
+_TOPIC_RANK = {topic: rank for rank, (topic, _) in enumerate(_TOPIC_RULES)}
+
+# Linguagens reconhecidas, em ordem de preferência (busca por substring)
+_CODE_LANGUAGES = ('python', 'javascript', 'java', 'c#', 'cpp', 'ruby', 'go', 'rust')
+
+# Poda do histórico: últimas mensagens mantidas íntegras e limites de tamanho
+_HISTORY_KEEP_LAST = 2
+_HISTORY_RECENT_LIMIT = 500
+_HISTORY_OLD_LIMIT = 120
+_HISTORY_WORD_RE = re.compile(r'\w{3,}')
+_CODE_MARKERS = ('```', 'código', 'function', 'class')
+
+_FENCE = '```'
+
+
+def _detect_topic(content_lower: str) -> Optional[str]:
+    """Retorna o tópico de maior prioridade presente no texto, ou None."""
+    best = None
+    for match in _TOPIC_RE.finditer(content_lower):
+        rank = _TOPIC_RANK[match.lastgroup]
+        if best is None or rank < best:
+            best = rank
+            if rank == 0:
+                break  # Prioridade máxima
+    return _TOPIC_RULES[best][0] if best is not None else None
+
+
+def _first_fence(content: str) -> Optional[str]:
+    """
+    Conteúdo do primeiro bloco ```lang\n...``` (mesma semântica de
+    ```(?:\\w+)?\n(.*?)``` com DOTALL), localizado só com str.find.
+    """
+    start = content.find(_FENCE)
+    while start != -1:
+        newline = content.find('\n', start + 3)
+        if newline == -1:
+            return None
+        tag = content[start + 3:newline]
+        if not tag or tag.replace('_', 'a').isalnum():
+            end = content.find(_FENCE, newline + 1)
+            return content[newline + 1:end] if end != -1 else None
+        start = content.find(_FENCE, start + 1)
+    return None
+
+
 class ContextManager:
     def __init__(self, max_history: int = 10):
         self.max_history = max_history
-        self.conversation_history: List[Dict] = []
+        # Buffer circular: append descarta a mensagem mais antiga em O(1)
+        self.conversation_history: Deque[Dict] = deque(maxlen=max_history)
+        # Primeiro bloco de código de cada mensagem (None se não houver),
+        # alinhado com conversation_history e extraído uma única vez em add_message
+        self._code_blocks: Deque[Optional[str]] = deque(maxlen=max_history)
         self.current_context: Dict = {
             'topic': None,
             'code_context': None,
@@ -26,28 +93,44 @@ class ContextManager:
                 'code': {'success_rate': 1.0, 'total_calls': 0}
             }
         }
-        self.context_file = os.path.join(os.path.dirname(__file__), '../assets/context.json')
+        # Preferências e projeto ficam em arquivos separados: cada mudança regrava só o seu
+        assets_dir = os.path.join(os.path.dirname(__file__), '../assets')
+        self.preferences_file = os.path.join(assets_dir, 'preferences.json')
+        self.project_file = os.path.join(assets_dir, 'project.json')
+        self.context_file = os.path.join(assets_dir, 'context.json')  # Formato antigo (só leitura)
         self._load_saved_context()
+        
+        # Memoização dos prompts: invalidada a cada mutação via _version
+        self._version = 0
+        self._prompt_cache: Dict[str, tuple] = {}  # model_type -> (versão, prompt)
+        self._code_context_cache: Optional[tuple] = None  # (versão, contexto)
+        
+        # Último segundo formatado em ISO-8601 (reaproveitado por _timestamp)
+        self._last_iso_sec = 0
+        self._last_iso_str = ''
+        
+        # Persistência em segundo plano: a fila guarda só o snapshot mais recente
+        self._save_queue: queue.Queue = queue.Queue(maxsize=1)
+        self._write_lock = threading.Lock()
+        threading.Thread(target=self._context_writer, name="context-writer", daemon=True).start()
+        atexit.register(self.flush)
     
     def _load_saved_context(self):
-        """Carrega contexto salvo se existir."""
+        """Carrega preferências e contexto de projeto salvos, se existirem."""
         try:
-            if os.path.exists(self.context_file):
-                try:
-                    with open(self.context_file, 'r', encoding='utf-8') as f:
-                        saved = json.load(f)
-                except (json.JSONDecodeError, UnicodeError):
-                    # Se o arquivo principal estiver corrompido, tenta o backup
-                    backup_file = f"{self.context_file}.bak"
-                    if os.path.exists(backup_file):
-                        with open(backup_file, 'r', encoding='utf-8') as f:
-                            saved = json.load(f)
-                    else:
-                        saved = {}
-                
-                # Atualiza apenas preferências e contexto de projeto
-                self.current_context['user_preferences'] = saved.get('user_preferences', {})
-                self.current_context['project_context'] = saved.get('project_context', None)
+            new_format = (self.preferences_file, self.project_file,
+                          f"{self.preferences_file}.bak", f"{self.project_file}.bak")
+            if any(os.path.exists(path) for path in new_format):
+                preferences = self._read_json(self.preferences_file).get('user_preferences', {})
+                project = self._read_json(self.project_file).get('project_context', None)
+            else:
+                # Formato antigo: tudo em context.json
+                saved = self._read_json(self.context_file)
+                preferences = saved.get('user_preferences', {})
+                project = saved.get('project_context', None)
+            
+            self.current_context['user_preferences'] = preferences
+            self.current_context['project_context'] = project
                 
         except Exception as e:
             print(f"[ContextManager] Erro ao carregar contexto: {e}")
@@ -55,6 +138,19 @@ class ContextManager:
             self.current_context['user_preferences'] = {}
             self.current_context['project_context'] = None
     
+    @staticmethod
+    def _read_json(path: str) -> Dict:
+        """Lê um arquivo JSON salvo; usa o backup .bak se o principal estiver corrompido ou ausente."""
+        try:
+            with open(path, 'rb') as f:
+                return jsonutil.loads(f.read())
+        except (FileNotFoundError, ValueError):  # ValueError: JSON inválido (json e orjson) ou UTF-8
+            backup_file = f"{path}.bak"
+            if os.path.exists(backup_file):
+                with open(backup_file, 'rb') as f:
+                    return jsonutil.loads(f.read())
+            return {}
+    
     def add_message(self, role: str, content: str, metadata: Dict = None):
         """
         Adiciona mensagem ao histórico com análise de contexto e metadados.
@@ -67,53 +163,67 @@ class ContextManager:
         message = {
             'role': role,
             'content': content,
-            'timestamp': datetime.now().isoformat(),
+            'timestamp': self._timestamp(),
             'metadata': metadata or {}
         }
         
         self.conversation_history.append(message)
+        self._code_blocks.append(self._extract_code_block(role, content))
+        self._version += 1
         
-        # Mantém apenas as últimas N mensagens
-        if len(self.conversation_history) > self.max_history:
-            self.conversation_history.pop(0)
-        
-        # Atualiza contexto e salva
+        # Atualiza contexto (nada persistente muda aqui, então não há escrita em disco)
         self._update_context(content, role, metadata)
-        self._save_context()
+    
+    def _timestamp(self) -> str:
+        """Timestamp ISO-8601 local; a parte até os segundos só é reformatada quando o segundo muda."""
+        sec, nanos = divmod(time.time_ns(), 1_000_000_000)
+        if sec != self._last_iso_sec:
+            self._last_iso_str = datetime.fromtimestamp(sec).isoformat()
+            self._last_iso_sec = sec
+        return f"{self._last_iso_str}.{nanos // 1000:06d}"
+    
+    @staticmethod
+    def _extract_code_block(role: str, content: str) -> Optional[str]:
+        """Extrai o primeiro bloco de código de respostas do assistente."""
+        if role == 'assistant':
+            block = _first_fence(content)
+            if block is not None:
+                return block.strip()
+        return None
     
     def _update_context(self, content: str, role: str, metadata: Dict = None):
         """Analisa mensagem para atualizar contexto atual com análise avançada."""
         content_lower = content.lower()
+        ctx = self.current_context
         
         # Atualiza métricas de performance dos modelos
         if metadata and 'model_type' in metadata:
             model_type = metadata['model_type']  # 'chat' ou 'code'
             success = metadata.get('success', True)
-            stats = self.current_context['model_performance'][model_type]
-            stats['total_calls'] += 1
+            stats = ctx['model_performance'][model_type]
+            total_calls = stats['total_calls'] + 1
+            stats['total_calls'] = total_calls
             # Atualiza taxa de sucesso com peso móvel
-            if stats['total_calls'] > 1:
-                stats['success_rate'] = (stats['success_rate'] * 0.8) + (1.0 if success else 0.0) * 0.2
+            if total_calls > 1:
+                rate = stats['success_rate']
+                new_rate = rate * 0.8 + (0.2 if success else 0.0)
+                # Em regime estável a taxa praticamente não muda: evita a escrita
+                if abs(new_rate - rate) > 1e-4:
+                    stats['success_rate'] = new_rate
             else:
                 stats['success_rate'] = 1.0 if success else 0.0
         
         # Detecta tópico e contexto técnico
         if role == 'user':
-            # Análise de tópico mais granular
-            if re.search(r'código|programa|desenvolv|implement|bug|error|debug', content_lower):
-                self.current_context['topic'] = 'programming'
-            elif re.search(r'explique|como|qual|por que|defin|conceito', content_lower):
-                self.current_context['topic'] = 'explanation'
-            elif re.search(r'ajuda|erro|problema|não consigo|falha', content_lower):
-                self.current_context['topic'] = 'help'
-            elif re.search(r'teste|validar|verificar|assert|spec', content_lower):
-                self.current_context['topic'] = 'testing'
+            # Análise de tópico mais granular (varredura única)
+            topic = _detect_topic(content_lower)
+            if topic:
+                ctx['topic'] = topic
             
             # Detecta linguagem de programação
-            langs = ['python', 'javascript', 'java', 'c#', 'cpp', 'ruby', 'go', 'rust']
-            for lang in langs:
+            for lang in _CODE_LANGUAGES:
                 if lang in content_lower:
-                    self.current_context['last_code_language'] = lang
+                    ctx['last_code_language'] = lang
                     break
     
     def get_context_prompt(self, model_type: str = 'chat') -> str:
@@ -123,13 +233,19 @@ class ContextManager:
         Args:
             model_type: 'chat' ou 'code' para otimizar o contexto
         """
+        cached = self._prompt_cache.get(model_type)
+        if cached is not None and cached[0] == self._version:
+            return cached[1]
+        
         prompt_parts = []
         
         # Contexto base com metadados
         if model_type == 'chat':
-            prompt_parts.append(f"Sessão iniciada em: {self.current_context['session_start']}")
-            if self.current_context['topic']:
-                prompt_parts.append(f"Tópico atual: {self.current_context['topic']}")
+            ctx = self.current_context
+            prompt_parts.append(f"Sessão iniciada em: {ctx['session_start']}")
+            topic = ctx['topic']
+            if topic:
+                prompt_parts.append(f"Tópico atual: {topic}")
         
         # Histórico recente relevante
         if self.conversation_history:
@@ -151,47 +267,89 @@ class ContextManager:
             prompt_parts.append("\nPreferências:")
             prompt_parts.extend(user_prefs)
         
-        return "\n".join(prompt_parts).strip()
+        prompt = "\n".join(prompt_parts).strip()
+        self._prompt_cache[model_type] = (self._version, prompt)
+        return prompt
     
     def _get_relevant_history(self, model_type: str) -> List[str]:
-        """Filtra e formata histórico relevante baseado no tipo de modelo."""
-        history = []
+        """
+        Seleciona histórico relevante por recência e sobreposição com a pergunta atual.
+        
+        As últimas mensagens entram sempre; das anteriores, ficam as de maior
+        pontuação (recência x palavras em comum), resumidas em uma linha curta.
+        """
         window = 5 if model_type == 'chat' else 3  # Janela maior para chat
         
-        for msg in self.conversation_history[-window:]:
+        messages = list(self.conversation_history)
+        if model_type == 'code':
             # Pula mensagens não relevantes para código
-            if model_type == 'code' and msg['role'] == 'assistant' and not any(
-                marker in msg['content'] for marker in ['```', 'código', 'function', 'class']
-            ):
-                continue
+            messages = [
+                msg for msg in messages
+                if msg['role'] != 'assistant' or any(marker in msg['content'] for marker in _CODE_MARKERS)
+            ]
+        
+        recent = messages[-_HISTORY_KEEP_LAST:]
+        older = messages[:-_HISTORY_KEEP_LAST]
+        slots = window - len(recent)
+        
+        kept = []
+        if older and slots > 0:
+            query_words = self._last_user_words()
+            total = len(older)
             
-            content = msg['content']
-            # Limita tamanho para manter contexto conciso
-            if len(content) > 500:
-                content = content[:497] + "..."
+            def score(item):
+                pos, msg = item
+                recency = (pos + 1) / total
+                if not query_words:
+                    return (0.0, recency)
+                shared = query_words.intersection(_HISTORY_WORD_RE.findall(msg['content'][:2000].lower()))
+                return (recency * len(shared) / len(query_words), recency)
             
-            history.append(f"{msg['role']}: {content}")
+            # Melhores pontuações, reapresentadas em ordem cronológica
+            kept = sorted(sorted(enumerate(older), key=score, reverse=True)[:slots])
+        
+        history = []
+        evicted = len(older) - len(kept)
+        if evicted > 0:
+            history.append(f"[Mensagens antigas omitidas: {evicted}, tópico={self.current_context['topic'] or 'geral'}]")
+        
+        for _, msg in kept:
+            history.append(f"{msg['role']}: {self._truncate(msg['content'], _HISTORY_OLD_LIMIT)}")
+        for msg in recent:
+            history.append(f"{msg['role']}: {self._truncate(msg['content'], _HISTORY_RECENT_LIMIT)}")
         
         return history
     
+    def _last_user_words(self) -> frozenset:
+        """Palavras da mensagem de usuário mais recente."""
+        for msg in reversed(self.conversation_history):
+            if msg['role'] == 'user':
+                return frozenset(_HISTORY_WORD_RE.findall(msg['content'].lower()))
+        return frozenset()
+    
+    @staticmethod
+    def _truncate(content: str, limit: int) -> str:
+        """Limita tamanho para manter contexto conciso."""
+        if len(content) > limit:
+            return content[:limit - 3] + "..."
+        return content
+    
     def _get_technical_context(self) -> List[str]:
         """Coleta contexto técnico para geração de código."""
         context = []
         
         # Linguagem preferida
-        if self.current_context['last_code_language']:
-            context.append(f"Linguagem: {self.current_context['last_code_language']}")
+        language = self.current_context['last_code_language']
+        if language:
+            context.append(f"Linguagem: {language}")
         
         # Adiciona fragmentos de código relevantes
         code_fragments = []
-        for msg in reversed(self.conversation_history):
-            if msg['role'] == 'assistant' and '```' in msg['content']:
-                # Extrai apenas o código entre backticks
-                code_blocks = re.findall(r'```(?:\w+)?\n(.*?)```', msg['content'], re.DOTALL)
-                if code_blocks:
-                    code_fragments.append(code_blocks[0].strip())
-                    if len(code_fragments) >= 2:  # Limita a 2 fragmentos
-                        break
+        for block in reversed(self._code_blocks):
+            if block is not None:
+                code_fragments.append(block)
+                if len(code_fragments) >= 2:  # Limita a 2 fragmentos
+                    break
         
         if code_fragments:
             context.append("Código relevante anterior:")
@@ -207,57 +365,101 @@ class ContextManager:
         if model_type == 'code':
             code_style = user_prefs.get('code_style', {})
             if code_style:
-                prefs.extend([
-                    f"- Estilo: {code_style.get('style', 'default')}",
-                    f"- Indentação: {code_style.get('indent', '4 espaços')}",
-                    f"- Documentação: {code_style.get('doc_style', 'detalhada')}"
-                ])
+                prefs.append(f"- Estilo: {code_style.get('style', 'default')}")
+                prefs.append(f"- Indentação: {code_style.get('indent', '4 espaços')}")
+                prefs.append(f"- Documentação: {code_style.get('doc_style', 'detalhada')}")
         else:
             chat_prefs = user_prefs.get('chat_preferences', {})
             if chat_prefs:
-                prefs.extend([
-                    f"- Formato: {chat_prefs.get('format', 'conciso')}",
-                    f"- Nível técnico: {chat_prefs.get('technical_level', 'médio')}"
-                ])
+                prefs.append(f"- Formato: {chat_prefs.get('format', 'conciso')}")
+                prefs.append(f"- Nível técnico: {chat_prefs.get('technical_level', 'médio')}")
         
         return prefs
     
-    def _save_context(self):
-        """Salva contexto atual em arquivo."""
+    def _save_context(self, preferences: bool = True, project: bool = True):
+        """Agenda o salvamento das partes persistentes indicadas (escrita feita pela thread de fundo)."""
+        ctx = self.current_context
+        last_save = datetime.now().isoformat()
+        to_save = {}
+        # Cópias profundas: a thread de fundo serializa enquanto update_preferences
+        # pode alterar os dicionários vivos
+        if preferences:
+            to_save[self.preferences_file] = {'user_preferences': copy.deepcopy(ctx['user_preferences']), 'last_save': last_save}
+        if project:
+            to_save[self.project_file] = {'project_context': copy.deepcopy(ctx['project_context']), 'last_save': last_save}
+        
+        # Funde com o snapshot ainda não gravado: rajadas viram uma única escrita
         try:
-            # Garante que o diretório assets existe
-            assets_dir = os.path.dirname(self.context_file)
-            os.makedirs(assets_dir, exist_ok=True)
-            
-            # Salva apenas dados persistentes
-            to_save = {
-                'user_preferences': self.current_context['user_preferences'],
-                'project_context': self.current_context['project_context'],
-                'last_save': datetime.now().isoformat()
-            }
-            
-            # Salva usando arquivo temporário para evitar corrupção
-            temp_file = f"{self.context_file}.tmp"
-            with open(temp_file, 'w', encoding='utf-8') as f:
-                json.dump(to_save, f, ensure_ascii=False, indent=2)
-            
-            # Renomeia para arquivo final (mais seguro em caso de crash)
-            if os.path.exists(self.context_file):
-                os.replace(self.context_file, f"{self.context_file}.bak")
-            os.rename(temp_file, self.context_file)
-            
-        except Exception as e:
-            print(f"[ContextManager] Erro ao salvar contexto: {e}")
+            self._save_queue.put_nowait(to_save)
+        except queue.Full:
+            try:
+                to_save = {**self._save_queue.get_nowait(), **to_save}
+                self._save_queue.task_done()  # O snapshot retirado volta fundido abaixo
+            except queue.Empty:
+                pass
+            try:
+                self._save_queue.put_nowait(to_save)
+            except queue.Full:
+                pass
+    
+    def _context_writer(self):
+        """Thread de fundo que grava os snapshots enfileirados."""
+        while True:
+            to_save = self._save_queue.get()
+            try:
+                with self._write_lock:
+                    self._write_context(to_save)
+            finally:
+                self._save_queue.task_done()
+    
+    def flush(self):
+        """Grava o snapshot pendente e aguarda a gravação em andamento (usado no encerramento)."""
+        # O lock espera a thread terminar a escrita atual: encerrar no meio dela
+        # poderia deixar só o .bak (entre os dois renames)
+        with self._write_lock:
+            try:
+                to_save = self._save_queue.get_nowait()
+            except queue.Empty:
+                to_save = None
+            if to_save is not None:
+                try:
+                    self._write_context(to_save)
+                finally:
+                    self._save_queue.task_done()
+        # Snapshot retirado da fila pela thread mas ainda sem o lock: espera ela terminar
+        self._save_queue.join()
+    
+    def _write_context(self, to_save: Dict):
+        """Grava cada arquivo do snapshot em disco de forma atômica (chamar com _write_lock)."""
+        for path, data in to_save.items():
+            try:
+                # Garante que o diretório assets existe
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                
+                # Salva usando arquivo temporário para evitar corrupção
+                temp_file = f"{path}.tmp"
+                with open(temp_file, 'wb') as f:
+                    f.write(jsonutil.dumps(data, pretty=True))
+                
+                # Renomeia para arquivo final (mais seguro em caso de crash)
+                if os.path.exists(path):
+                    os.replace(path, f"{path}.bak")
+                os.rename(temp_file, path)
+                
+            except Exception as e:
+                print(f"[ContextManager] Erro ao salvar contexto: {e}")
     
     def update_preferences(self, preferences: Dict):
         """Atualiza preferências do usuário."""
         self.current_context['user_preferences'].update(preferences)
-        self._save_context()
+        self._version += 1
+        self._save_context(project=False)
     
     def set_project_context(self, context: Dict):
         """Define contexto do projeto atual."""
         self.current_context['project_context'] = context
-        self._save_context()
+        self._version += 1
+        self._save_context(preferences=False)
     
     def get_model_performance(self) -> Dict:
         """Retorna métricas de performance dos modelos."""
@@ -268,22 +470,28 @@ class ContextManager:
         Retorna contexto específico para geração de código.
         Usado pelo agente híbrido para contextualizar geração de código.
         """
+        cached = self._code_context_cache
+        if cached is not None and cached[0] == self._version:
+            return cached[1]
+        
+        ctx = self.current_context
         context_parts = []
         
         # Adiciona linguagem se disponível
-        if self.current_context['last_code_language']:
-            context_parts.append(f"Linguagem: {self.current_context['last_code_language']}")
+        language = ctx['last_code_language']
+        if language:
+            context_parts.append(f"Linguagem: {language}")
         
         # Analisa histórico por discussões relevantes de código
         code_blocks = []
         requirements = []
         
-        for msg in reversed(self.conversation_history[-10:]):  # Aumentado de 5 para 10 mensagens
+        recent = zip(reversed(self.conversation_history), reversed(self._code_blocks))
+        for msg, block in islice(recent, 10):  # Aumentado de 5 para 10 mensagens
             if msg['role'] == 'assistant' and '```' in msg['content']:
-                # Extrai código entre backticks
-                code = re.findall(r'```(?:\w+)?\n(.*?)```', msg['content'], re.DOTALL)
-                if code:
-                    code_blocks.append(f"Código anterior gerado:\n{code[0].strip()}")
+                # Código já extraído em add_message
+                if block is not None:
+                    code_blocks.append(f"Código anterior gerado:\n{block}")
                     if len(code_blocks) >= 5:  # Aumentado de 2 para 5 blocos de código
                         break
             elif msg['role'] == 'user':
@@ -294,26 +502,21 @@ class ContextManager:
                     if len(requirements) >= 5:  # Aumentado de 2 para 5 requisitos
                         break
         
-        # Adiciona requisitos primeiro
-        if requirements:
-            context_parts.extend(requirements)
-        
-        # Depois adiciona código
-        if code_blocks:
-            context_parts.extend(code_blocks)
+        # Adiciona requisitos primeiro, depois código
+        context_parts += requirements
+        context_parts += code_blocks
         
         # Adiciona preferências de código se existirem
-        code_prefs = self.current_context['user_preferences'].get('code_style', {})
+        code_prefs = ctx['user_preferences'].get('code_style', {})
         if code_prefs:
-            prefs = [
-                "Preferências de código:",
-                f"- Estilo: {code_prefs.get('style', 'default')}",
-                f"- Indentação: {code_prefs.get('indent', '4 espaços')}",
-                f"- Documentação: {code_prefs.get('doc_style', 'detalhada')}"
-            ]
-            context_parts.extend(prefs)
+            context_parts.append("Preferências de código:")
+            context_parts.append(f"- Estilo: {code_prefs.get('style', 'default')}")
+            context_parts.append(f"- Indentação: {code_prefs.get('indent', '4 espaços')}")
+            context_parts.append(f"- Documentação: {code_prefs.get('doc_style', 'detalhada')}")
         
-        return "\n".join(context_parts) if context_parts else None
+        code_context = "\n".join(context_parts) if context_parts else None
+        self._code_context_cache = (self._version, code_context)
+        return code_context
     
     def clear(self, save_preferences: bool = True):
         """
@@ -326,6 +529,8 @@ class ContextManager:
         old_project = self.current_context['project_context']
         
         self.conversation_history.clear()
+        self._code_blocks.clear()
+        self._version += 1
         self.current_context = {
             'topic': None,
             'code_context': None,
@@ -338,4 +543,7 @@ class ContextManager:
                 'chat': {'success_rate': 1.0, 'total_calls': 0},
                 'code': {'success_rate': 1.0, 'total_calls': 0}
             }
-        }
\ No newline at end of file
+        }
+        
+        if not save_preferences:
+            self._save_context(project=False)
@@ -2,21 +2,62 @@
 Configuração e otimização dos modelos LLM.
 """
 import os
+import shutil
+import threading
+import time
 import psutil
-from typing import Dict, Any
-import torch
+from functools import lru_cache
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, Any, Optional
 import logging
-from llama_cpp import Llama
+
+import jsonutil
+
+if TYPE_CHECKING:
+    from llama_cpp import Llama
 
 logger = logging.getLogger("model_setup")
 
+# Validade da leitura de memória; /proc/meminfo não precisa ser relido a cada requisição
+_RAM_TTL = 1.0
+_ram_cache = {'t': 0.0, 'v': None}
+
+# Modelos já validados pela inferência teste, identificados por (caminho, tamanho, mtime)
+_VERIFIED_PATH = Path.home() / '.cache' / 'ide-pessoal' / 'model_verified.json'
+_verified_lock = threading.Lock()
+
+@lru_cache(maxsize=1)
+def _cpu_count() -> int:
+    """Número de CPUs (imutável durante a execução)."""
+    return os.cpu_count() or 4
+
+def _virtual_memory():
+    """psutil.virtual_memory() com cache de até _RAM_TTL segundos."""
+    now = time.monotonic()
+    if _ram_cache['v'] is None or now - _ram_cache['t'] > _RAM_TTL:
+        _ram_cache['v'] = psutil.virtual_memory()
+        _ram_cache['t'] = now
+    return _ram_cache['v']
+
+@lru_cache(maxsize=1)
+def _has_gpu() -> bool:
+    """Detecta GPU CUDA uma única vez; só importa torch se houver driver NVIDIA."""
+    # Sem driver NVIDIA não há CUDA: evita o custo de importar torch no caminho CPU
+    if not (os.path.exists('/proc/driver/nvidia/version') or shutil.which('nvidia-smi')):
+        return False
+    try:
+        import torch  # Import pesado (inicialização CUDA)
+    except ImportError:
+        return False
+    return torch.cuda.is_available()
+
 def optimize_model_params(model_type: str) -> Dict[str, Any]:
     """Otimiza parâmetros do modelo baseado no hardware disponível."""
     
     # Detecta recursos disponíveis
-    cpu_count = os.cpu_count() or 4
-    ram = psutil.virtual_memory()
-    has_gpu = torch.cuda.is_available()
+    cpu_count = _cpu_count()
+    ram = _virtual_memory()
+    has_gpu = _has_gpu()
     
     # Parâmetros base otimizados
     params = {
@@ -50,9 +91,11 @@ def optimize_model_params(model_type: str) -> Dict[str, Any]:
     logger.info(f"Parâmetros otimizados para modelo {model_type}: {params}")
     return params
 
-def load_optimized_model(model_path: str, model_type: str) -> Llama:
+def load_optimized_model(model_path: str, model_type: str) -> Optional["Llama"]:
     """Carrega modelo com parâmetros otimizados."""
     try:
+        from llama_cpp import Llama  # Import adiado até o primeiro carregamento
+        
         if not os.path.exists(model_path):
             raise FileNotFoundError(f"Modelo não encontrado: {model_path}")
         
@@ -66,26 +109,76 @@ def load_optimized_model(model_path: str, model_type: str) -> Llama:
         # Carrega modelo com parâmetros otimizados
         model = Llama(model_path=model_path, **params)
         
-        # Força uma inferência teste para validar o modelo
-        test_prompt = "Teste de modelo."
-        try:
-            model(test_prompt, max_tokens=10)
-            logger.info(f"Modelo {model_type} carregado e testado com sucesso")
+        model._warm_error = None
+        model._warm_event = threading.Event()
+        
+        # Arquivo idêntico ao último validado (mesmo stat): dispensa a inferência teste
+        key = _model_key(model_path)
+        if key in _load_verified():
+            logger.info(f"Modelo {model_type} carregado (já validado anteriormente)")
+            model._warm_event.set()
             return model
-        except Exception as e:
-            logger.error(f"Falha no teste do modelo {model_type}: {e}")
-            del model
-            gc.collect()
-            return None
+        
+        # Inferência teste em segundo plano: o carregamento retorna logo e o
+        # primeiro uso aguarda o aquecimento via wait_until_warm()
+        threading.Thread(
+            target=_warm_up, args=(model, model_type, key),
+            name=f"warmup-{model_type}", daemon=True
+        ).start()
+        return model
         
     except Exception as e:
         logger.error(f"Erro ao carregar modelo {model_type}: {e}")
         return None
 
+def _warm_up(model: "Llama", model_type: str, key: list):
+    """Força uma inferência teste para validar e aquecer o modelo."""
+    try:
+        model("Teste de modelo.", max_tokens=10)
+        logger.info(f"Modelo {model_type} carregado e testado com sucesso")
+        _mark_verified(key)
+    except Exception as e:
+        logger.error(f"Falha no teste do modelo {model_type}: {e}")
+        model._warm_error = e
+    finally:
+        model._warm_event.set()
+
+def _model_key(model_path: str) -> list:
+    """Identifica o arquivo do modelo só por stat (sem calcular hash)."""
+    st = os.stat(model_path)
+    return [os.path.abspath(model_path), st.st_size, int(st.st_mtime)]
+
+def _load_verified() -> list:
+    """Lê as chaves de modelos já validados."""
+    try:
+        return jsonutil.loads(_VERIFIED_PATH.read_bytes()).get('verified', [])
+    except (OSError, ValueError, AttributeError):
+        return []
+
+def _mark_verified(key: list):
+    """Registra o modelo como validado, substituindo versões antigas do mesmo arquivo."""
+    try:
+        with _verified_lock:
+            verified = [k for k in _load_verified() if k[0] != key[0]]
+            verified.append(key)
+            _VERIFIED_PATH.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = _VERIFIED_PATH.with_suffix('.tmp')
+            tmp_path.write_bytes(jsonutil.dumps({'verified': verified}, pretty=True))
+            tmp_path.replace(_VERIFIED_PATH)
+    except OSError as e:
+        logger.warning(f"Não foi possível registrar validação do modelo: {e}")
+
+def wait_until_warm(model: "Llama", timeout: Optional[float] = None) -> bool:
+    """Aguarda o fim do aquecimento do modelo; retorna False se o teste falhou."""
+    event = getattr(model, '_warm_event', None)
+    if event is not None and not event.wait(timeout):
+        return False
+    return getattr(model, '_warm_error', None) is None
+
 def get_optimal_generation_params(model_type: str, query_length: int) -> Dict[str, Any]:
     """Calcula parâmetros ótimos para geração baseado no tipo e tamanho da query."""
     
-    ram = psutil.virtual_memory()
+    ram = _virtual_memory()
     is_complex = query_length > 100
     
     if model_type == 'chat':
@@ -4,12 +4,135 @@ Gerencia a detecção, análise e processamento de código.
 """
 
 import re
-import json
 import os
 from typing import Dict, Optional, List, Any
 from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
 
+import jsonutil
+
+# Palavras-chave por linguagem, em ordem de prioridade
+_CODE_TYPE_KEYWORDS = (
+    ('html', ('html', 'página', 'site', 'web', 'frontend', 'interface', 'layout', 'design', 'estilo', 'css')),
+    ('python', ('python', 'script', 'classe', 'função', 'algoritmo', 'dados', 'análise', 'processamento', 'machine learning', 'data science')),
+    ('javascript', ('javascript', 'js', 'função', 'frontend', 'react', 'vue', 'angular', 'node', 'browser', 'web app')),
+    ('java', ('java', 'android', 'spring', 'enterprise', 'backend', 'classe', 'objeto')),
+    ('cpp', ('c++', 'cpp', 'sistema', 'performance', 'baixo nível', 'hardware', 'game')),
+    ('rust', ('rust', 'sistema', 'segurança', 'performance', 'concorrência')),
+    ('go', ('go', 'golang', 'concorrência', 'backend', 'microserviços')),
+)
+# Uma alternação compilada por linguagem, testadas em ordem de prioridade: a primeira
+# que casa encerra a busca (o lookahead único custava ~10x mais em prompts longos)
+_CODE_TYPE_RES = tuple(
+    (lang, re.compile('|'.join(map(re.escape, keywords)))) for lang, keywords in _CODE_TYPE_KEYWORDS
+)
+
+# Detecção por contexto e padrões (aplicada ao prompt já em minúsculas).
+# Cada linguagem tem um pré-filtro de substrings: sem nenhuma delas, nenhum padrão casa.
+# Tuplas (lang, literais, padrões) em ordem de prioridade: iteração sem dict.items()
+_CONTEXT_PATTERNS = (
+    ('python', ('def', 'class', 'import'),
+     tuple(re.compile(p, re.I) for p in (r'def\s+\w+', r'class\s+\w+', r'import\s+\w+'))),
+    ('javascript', ('function', 'const', 'let'),
+     tuple(re.compile(p, re.I) for p in (r'function\s+\w+', r'const\s+\w+', r'let\s+\w+'))),
+    ('html', ('<',),
+     tuple(re.compile(p, re.I) for p in (r'<\w+>', r'<!DOCTYPE\s+html>', r'<head>', r'<body>'))),
+)
+# Pedidos de exibição ou manipulação sem linguagem explícita
+_DISPLAY_KEYWORDS = ('exibir', 'mostrar', 'interface')
+
+# Extração de conteúdo principal: (padrão, grupo), em ordem de prioridade
+_CONTENT_PATTERNS = tuple((re.compile(p, re.I), g) for p, g in (
+    (r'["\']([^"\']+)["\']', 1),  # Texto entre aspas
+    (r'(?:exib|mostr)[ae]\s+(?:a\s+)?(?:mensagem|frase?|texto)\s+([^\.!?]+)', 1),
+    (r'onde\s+(?:exib|mostr)[ae]\s+([^\.!?]+)', 1),
+    (r'que\s+(?:dig|mostr|exib)[ae]\s+([^\.!?]+)', 1),
+    (r'criar\s+(?:um\s+)?(?:código|programa|script)\s+(?:que\s+)?([^\.!?]+)', 1),
+    (r'desenvolva\s+(?:um\s+)?(?:código|programa|script)\s+(?:que\s+)?([^\.!?]+)', 1)
+))
+
+# Dependências
+_HREF_RE = re.compile(r'href=[\'"](.*?)[\'"]')
+_SRC_RE = re.compile(r'src=[\'"](.*?)[\'"]')
+
+# Formatação
+_MINIFY_COMMENT_RE = re.compile(r'//.*?\n|/\*.*?\*/', re.S)
+_WS_RE = re.compile(r'\s+')
+_HTML_SECTIONS = tuple(
+    (f'<{section}>', f'<!-- Início da seção {section} -->\n<{section}>')
+    for section in ('head', 'body', 'style', 'script')
+)
+
+# Limpeza e validação
+_DUP_META_RE = re.compile(r'(<meta[^>]*>)\1+')
+_META_RE = re.compile(r'<meta[^>]*>')
+_HEAD_RE = re.compile(r'<head[^>]*>')
+_DEFAULT_HEAD = '''<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">'''
+_PY_DOCSTRING_RE = re.compile(r'""".*?"""\s*""".*?"""', re.S)
+_PY_CODING_RE = re.compile(r'#.*coding.*utf-8', re.I)
+
+def _keyword_code_type(prompt: str) -> Optional[str]:
+    """Linguagem de maior prioridade cujas palavras-chave aparecem no prompt."""
+    for lang, keywords_re in _CODE_TYPE_RES:
+        if keywords_re.search(prompt):
+            return lang
+    return None
+
+def _python_imports(code: str) -> List[str]:
+    """
+    Módulos importados em código Python, linha a linha com startswith/split.
+    
+    'import a' -> 'a'; 'from a import b' -> 'a' (primeiro token, como no antigo regex).
+    """
+    modules = []
+    for line in code.split('\n'):
+        tokens = line.split(None, 3)
+        if len(tokens) < 2:
+            continue
+        first = tokens[0]
+        if first == 'import':
+            modules.append(tokens[1])
+        elif first == 'from' and len(tokens) >= 4 and tokens[2] == 'import':
+            modules.append(tokens[1])
+    return modules
+
+@lru_cache(maxsize=512)
+def _detect_code_type(prompt: str) -> str:
+    """Detecta o tipo de código em um prompt já em minúsculas."""
+    # Detecção por palavras-chave específicas (varredura única)
+    lang = _keyword_code_type(prompt)
+    if lang:
+        return lang
+    
+    # Detecção por contexto e padrões
+    for lang, literals, patterns in _CONTEXT_PATTERNS:
+        if any(lit in prompt for lit in literals) and any(pattern.search(prompt) for pattern in patterns):
+            return lang
+    
+    # Detecção por contexto de exibição ou manipulação
+    if any(kw in prompt for kw in _DISPLAY_KEYWORDS):
+        return 'html'
+    
+    return 'text'  # Tipo padrão
+
+@lru_cache(maxsize=512)
+def _extract_content(prompt: str) -> str:
+    """Extrai o conteúdo principal do pedido do usuário."""
+    # Extração de conteúdo principal com padrões mais abrangentes
+    for pattern, group in _CONTENT_PATTERNS:
+        if match := pattern.search(prompt):
+            content = match.group(group).strip()
+            if content:
+                return content
+            break
+    
+    # Extrai descrição se não houver conteúdo
+    words = prompt.split()[:12]  # Aumentado de 8 para 12 palavras
+    return ' '.join(words)
+
 class CodeTemplates:
     """Gerenciador de templates e processamento de código."""
     
@@ -29,40 +152,7 @@ class CodeTemplates:
         Returns:
             Tipo de código detectado (html, python, javascript, etc)
         """
-        prompt = prompt.lower()
-        
-        # Detecção por palavras-chave específicas e mais abrangente
-        code_type_mapping = {
-            'html': ['html', 'página', 'site', 'web', 'frontend', 'interface', 'layout', 'design', 'estilo', 'css'],
-            'python': ['python', 'script', 'classe', 'função', 'algoritmo', 'dados', 'análise', 'processamento', 'machine learning', 'data science'],
-            'javascript': ['javascript', 'js', 'função', 'frontend', 'react', 'vue', 'angular', 'node', 'browser', 'web app'],
-            'java': ['java', 'android', 'spring', 'enterprise', 'backend', 'classe', 'objeto'],
-            'cpp': ['c++', 'cpp', 'sistema', 'performance', 'baixo nível', 'hardware', 'game'],
-            'rust': ['rust', 'sistema', 'segurança', 'performance', 'concorrência'],
-            'go': ['go', 'golang', 'concorrência', 'backend', 'microserviços']
-        }
-        
-        # Verifica cada tipo de código
-        for lang, keywords in code_type_mapping.items():
-            if any(kw in prompt for kw in keywords):
-                return lang
-        
-        # Detecção por contexto e padrões
-        context_patterns = {
-            'python': [r'def\s+\w+', r'class\s+\w+', r'import\s+\w+'],
-            'javascript': [r'function\s+\w+', r'const\s+\w+', r'let\s+\w+'],
-            'html': [r'<\w+>', r'<!DOCTYPE\s+html>', r'<head>', r'<body>']
-        }
-        
-        for lang, patterns in context_patterns.items():
-            if any(re.search(pattern, prompt, re.I) for pattern in patterns):
-                return lang
-        
-        # Detecção por contexto de exibição ou manipulação
-        if any(kw in prompt for kw in ['exibir', 'mostrar', 'interface']):
-            return 'html'
-        
-        return 'text'  # Tipo padrão
+        return _detect_code_type(prompt.lower())
     
     def extract_info(self, prompt: str) -> Dict[str, Any]:
         """
@@ -74,53 +164,29 @@ class CodeTemplates:
         Returns:
             Dicionário com informações extraídas e contexto
         """
-        info = {
-            'content': '',
+        # Dicionário novo a cada chamada: o cache guarda só o conteúdo extraído
+        return {
+            'content': _extract_content(prompt),
             'description': '',
-            'type': self.detect_code_type(prompt)
+            'type': self.detect_code_type(prompt),
+            'date': datetime.now().strftime('%Y-%m-%d')  # Data atual
         }
-        
-        # Extração de conteúdo principal com padrões mais abrangentes
-        content_patterns = [
-            (r'["\']([^"\']+)["\']', 1),  # Texto entre aspas
-            (r'(?:exib|mostr)[ae]\s+(?:a\s+)?(?:mensagem|frase?|texto)\s+([^\.!?]+)', 1),
-            (r'onde\s+(?:exib|mostr)[ae]\s+([^\.!?]+)', 1),
-            (r'que\s+(?:dig|mostr|exib)[ae]\s+([^\.!?]+)', 1),
-            (r'criar\s+(?:um\s+)?(?:código|programa|script)\s+(?:que\s+)?([^\.!?]+)', 1),
-            (r'desenvolva\s+(?:um\s+)?(?:código|programa|script)\s+(?:que\s+)?([^\.!?]+)', 1)
-        ]
-        
-        for pattern, group in content_patterns:
-            if match := re.search(pattern, prompt, re.I):
-                info['content'] = match.group(group).strip()
-                break
-                
-        # Extrai descrição se não houver conteúdo
-        if not info['content']:
-            words = prompt.split()[:12]  # Aumentado de 8 para 12 palavras
-            info['content'] = ' '.join(words)
-            
-        # Adiciona data atual
-        info['date'] = datetime.now().strftime('%Y-%m-%d')
-        
-        return info
 
     def _load_cache(self) -> Dict:
         """Carrega cache de templates."""
-        if self.cache_file.exists():
-            try:
-                return json.loads(self.cache_file.read_text(encoding='utf-8'))
-            except json.JSONDecodeError:
-                return {}
-        return {}
+        # Leitura direta: sem stat() prévio nem corrida entre exists() e a abertura
+        try:
+            data = self.cache_file.read_bytes()
+            return jsonutil.loads(data)
+        except FileNotFoundError:
+            return {}
+        except ValueError:  # JSONDecodeError (json e orjson) ou UTF-8 inválido
+            return {}
         
     def _save_cache(self):
         """Salva cache de templates."""
         self.cache_file.parent.mkdir(parents=True, exist_ok=True)
-        self.cache_file.write_text(
-            json.dumps(self.template_cache, ensure_ascii=False, indent=2),
-            encoding='utf-8'
-        )
+        self.cache_file.write_bytes(jsonutil.dumps(self.template_cache, pretty=True))
 
     def set_context(self, **kwargs):
         """
@@ -146,13 +212,15 @@ class CodeTemplates:
         
         if code_type == 'python':
             # Detecta imports Python
-            imports = re.findall(r'^\s*(?:from\s+(\S+)\s+)?import\s+(\S+)', code, re.M)
-            deps.extend(m[0] or m[1] for m in imports if m[0] or m[1])
+            if 'import' in code:
+                deps.extend(_python_imports(code))
             
         elif code_type == 'html':
             # Detecta dependências web (CSS, JS)
-            deps.extend(re.findall(r'href=[\'"](.*?)[\'"]', code))
-            deps.extend(re.findall(r'src=[\'"](.*?)[\'"]', code))
+            if 'href=' in code:
+                deps.extend(_HREF_RE.findall(code))
+            if 'src=' in code:
+                deps.extend(_SRC_RE.findall(code))
             
         return [d for d in deps if not d.startswith(('.', '/'))]
 
@@ -170,19 +238,16 @@ class CodeTemplates:
         """
         if format_type == 'minified':
             # Remove comentários e espaços extras
-            code = re.sub(r'//.*?\n|/\*.*?\*/', '', code, flags=re.S)
-            code = re.sub(r'\s+', ' ', code)
+            if '//' in code or '/*' in code:
+                code = _MINIFY_COMMENT_RE.sub('', code)
+            code = _WS_RE.sub(' ', code)
             
         elif format_type == 'commented':
             # Adiciona comentários explicativos
             if code_type == 'html':
-                sections = ['head', 'body', 'style', 'script']
-                for section in sections:
-                    code = re.sub(
-                        f'<{section}>', 
-                        f'<!-- Início da seção {section} -->\n<{section}>', 
-                        code
-                    )
+                # Marcadores literais: str.replace dispensa o regex
+                for tag, replacement in _HTML_SECTIONS:
+                    code = code.replace(tag, replacement)
             
         return code.strip()
         
@@ -203,30 +268,29 @@ class CodeTemplates:
         code = code.strip()
         
         if code_type == 'html':
-            # Remove meta tags duplicadas
-            code = re.sub(r'(<meta[^>]*>)\1+', r'\1', code)
-            
-            # Limita número de meta tags
-            meta_tags = re.findall(r'<meta[^>]*>', code)
-            if len(meta_tags) > 3:
-                code = re.sub(r'<meta[^>]*>', '', code)
-                code = re.sub(r'<head[^>]*>', '''<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">''', code)
+            if '<meta' in code:
+                # Remove meta tags duplicadas
+                code = _DUP_META_RE.sub(r'\1', code)
+                
+                # Limita número de meta tags: a mesma passada conta e remove
+                without_meta, meta_count = _META_RE.subn('', code)
+                if meta_count > 3:
+                    code = _HEAD_RE.sub(_DEFAULT_HEAD, without_meta)
             
             # Garante fechamento de tags
-            if not code.strip().endswith('</html>'):
+            trimmed = code.rstrip()
+            if not trimmed.endswith('</html>'):
                 if '</body>' not in code:
-                    code = code.rstrip() + '\n</body>\n</html>'
+                    code = trimmed + '\n</body>\n</html>'
                 else:
-                    code = code.rstrip() + '\n</html>'
+                    code = trimmed + '\n</html>'
                     
         elif code_type == 'python':
             # Remove docstrings duplicadas
-            code = re.sub(r'""".*?"""\s*""".*?"""', '"""\\1"""', code, flags=re.S)
+            code = _PY_DOCSTRING_RE.sub('"""\\1"""', code)
             
             # Garante codificação UTF-8
-            if not re.search(r'#.*coding.*utf-8', code, re.I):
+            if not _PY_CODING_RE.search(code):
                 code = '# -*- coding: utf-8 -*-\n' + code
                 
         return code
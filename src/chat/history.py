@@ -1,10 +1,19 @@
 import os
-import json
+import heapq
+import uuid
+import datetime
+
+import jsonutil
+
+_MAX_MESSAGES = 1000  # Aumentado mas com limpeza seletiva
 
 class ChatHistory:
-    def __init__(self, path="logs/chat_history.json"):
+    def __init__(self, path="logs/chat_history.jsonl"):
+        # JSON Lines: cada mensagem é anexada ao arquivo sem reescrever o histórico
         self.path = path
         self.conversations = []
+        self._file_entries = 0  # Linhas no arquivo (inclui mensagens já podadas da memória)
+        self._current_session_id = str(uuid.uuid4())  # ID da sessão atual
         self.load()
     def add_message(self, msg, role="user", metadata=None):
         """
@@ -15,11 +24,43 @@ class ChatHistory:
             role: Papel do emissor ('user', 'assistant', 'system', 'code')
             metadata: Metadados opcionais (tempo de resposta, tokens, etc)
         """
-        import datetime
+        entry = self._build_entry(msg, role, metadata)
+        if entry is None:
+            return False
+        
+        self.conversations.append(entry)
+        self._append(entry)
+        
+        # Gerenciamento de memória
+        if len(self.conversations) > _MAX_MESSAGES:
+            # Mantém mensagens mais recentes e importantes
+            self._optimize_history(_MAX_MESSAGES)
+            
+    def add_messages(self, messages):
+        """
+        Adiciona um lote de mensagens com uma única escrita no arquivo.
+        
+        Args:
+            messages: Iterável de tuplas (role, msg) ou (role, msg, metadata)
+        """
+        entries = []
+        for role, msg, *metadata in messages:
+            entry = self._build_entry(msg, role, metadata[0] if metadata else None)
+            if entry is not None:
+                self.conversations.append(entry)
+                entries.append(entry)
+        if not entries:
+            return
+        self._append_many(entries)
         
+        if len(self.conversations) > _MAX_MESSAGES:
+            self._optimize_history(_MAX_MESSAGES)
+            
+    def _build_entry(self, msg, role, metadata):
+        """Valida e normaliza uma mensagem; retorna None se ela for inválida."""
         # Validação de entrada
         if not isinstance(msg, str) or not msg.strip():
-            return False
+            return None
             
         if role not in ['user', 'assistant', 'system', 'code']:
             role = 'user'  # Fallback seguro
@@ -27,34 +68,15 @@ class ChatHistory:
         # Limpeza e normalização
         msg = msg.strip()
         
-        entry = {
+        return {
             "id": len(self.conversations) + 1,
             "timestamp": datetime.datetime.now().isoformat(),
             "role": role,
             "content": msg,
             "metadata": metadata or {},
-            "session_id": self._get_session_id()
+            "session_id": self._current_session_id
         }
-        
-        self.conversations.append(entry)
-        
-        # Gerenciamento de memória
-        max_msgs = 1000  # Aumentado mas com limpeza seletiva
-        if len(self.conversations) > max_msgs:
-            # Mantém mensagens mais recentes e importantes
-            self._optimize_history(max_msgs)
             
-        # Salva automaticamente a cada X mensagens
-        if len(self.conversations) % 10 == 0:
-            self.save()
-            
-    def _get_session_id(self):
-        """Gera ou retorna ID da sessão atual"""
-        if not hasattr(self, '_current_session_id'):
-            import uuid
-            self._current_session_id = str(uuid.uuid4())
-        return self._current_session_id
-        
     def _optimize_history(self, max_size):
         """Otimiza o histórico mantendo mensagens importantes"""
         if len(self.conversations) <= max_size:
@@ -63,7 +85,7 @@ class ChatHistory:
         # Prioriza mensagens por importância
         important = [msg for msg in self.conversations 
                     if msg.get('metadata', {}).get('important', False) 
-                    or msg['role'] in ['system', 'code']]
+                    or msg.get('role') in ['system', 'code']]
                     
         # Calcula quantas mensagens regulares podemos manter
         regular_limit = max_size - len(important)
@@ -71,29 +93,63 @@ class ChatHistory:
             regular_limit = max_size // 2
             
         # Pega as mensagens mais recentes que não são importantes
+        # (identidade em set: evita comparar dicts contra a lista inteira)
+        important_ids = {id(msg) for msg in important}
         regular = [msg for msg in self.conversations 
-                  if msg not in important][-regular_limit:]
+                  if id(msg) not in important_ids][-regular_limit:]
                   
-        # Combina e ordena por timestamp
-        self.conversations = sorted(
-            important + regular,
+        # Combina por timestamp: as duas listas já estão em ordem cronológica
+        self.conversations = list(heapq.merge(
+            important, regular,
             key=lambda x: x['timestamp']
-        )
-        if len(self.conversations) % 10 == 0:
-            self.save()
+        ))
         
-        self.save()
+        # Compacta o arquivo só quando as linhas podadas dominam (custo amortizado)
+        if self._file_entries > 2 * max_size:
+            self.save()
     def clear(self):
         """Limpa todo o histórico manualmente."""
         self.conversations = []
         self.save()
     def get_history(self):
         return self.conversations
+    def _append(self, entry):
+        """Anexa uma mensagem ao arquivo JSON Lines."""
+        self._append_many((entry,))
+    def _append_many(self, entries):
+        """Anexa mensagens ao arquivo JSON Lines em uma única escrita."""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'ab') as f:
+            f.write(b''.join(map(jsonutil.dumps_line, entries)))
+        self._file_entries += len(entries)
     def save(self):
+        """Reescreve o arquivo inteiro (compactação) a partir do histórico em memória."""
         os.makedirs(os.path.dirname(self.path), exist_ok=True)
-        with open(self.path, 'w', encoding='utf-8') as f:
-            json.dump(self.conversations, f, ensure_ascii=False, indent=2)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(b''.join(map(jsonutil.dumps_line, self.conversations)))
+        os.replace(tmp_path, self.path)
+        self._file_entries = len(self.conversations)
     def load(self):
         if os.path.exists(self.path):
-            with open(self.path, 'r', encoding='utf-8') as f:
-                self.conversations = json.load(f)
+            conversations = []
+            with open(self.path, 'rb') as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        conversations.append(jsonutil.loads(line))
+                    except ValueError:
+                        continue  # Linha truncada por encerramento abrupto
+            self.conversations = conversations
+            self._file_entries = len(conversations)
+        else:
+            # Migra o formato antigo (lista JSON única) para JSON Lines
+            legacy_path = os.path.splitext(self.path)[0] + '.json'
+            if legacy_path != self.path and os.path.exists(legacy_path):
+                with open(legacy_path, 'rb') as f:
+                    self.conversations = jsonutil.loads(f.read())
+                self.save()
+        if len(self.conversations) > _MAX_MESSAGES:
+            # Arquivo ainda não compactado: mantém em memória só o limite
+            self._optimize_history(_MAX_MESSAGES)
@@ -0,0 +1,33 @@
+"""
+Serialização JSON compartilhada pelos módulos do IDE.
+Usa orjson quando instalado e o json da biblioteca padrão caso contrário;
+todas as funções trabalham com bytes UTF-8.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:  # Fallback para ambientes sem a wheel do orjson
+    orjson = None
+
+
+def dumps(obj, pretty: bool = False) -> bytes:
+    """Serializa para bytes UTF-8 (compacto, ou indentado com 2 espaços se pretty)."""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if pretty else 0)
+        return orjson.dumps(obj, option=option)
+    if pretty:
+        return json.dumps(obj, ensure_ascii=False, indent=2).encode('utf-8')
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def dumps_line(obj) -> bytes:
+    """Serializa como uma linha JSON Lines (compacta, terminada em quebra de linha)."""
+    return dumps(obj) + b'\n'
+
+
+def loads(data):
+    """Desserializa JSON de bytes ou str; erros de parse são ValueError."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
@@ -15,8 +15,8 @@ def main():
     settings = UserSettings()
     
     print("\n--- Status do Sistema ---")
-    chat_ready = (hybrid_agent.models.get('chat', None) is not None)
-    code_ready = (hybrid_agent.models.get('code', None) is not None)
+    chat_ready = hybrid_agent.is_model_ready('chat')
+    code_ready = hybrid_agent.is_model_ready('code')
     print(f"Modelo de Chat: {'Pronto' if chat_ready else 'Não inicializado'}")
     print(f"Modelo de Código: {'Pronto' if code_ready else 'Não inicializado'}")
     
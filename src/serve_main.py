@@ -2,15 +2,21 @@ from flask import Flask, render_template, request, jsonify, send_from_directory
 from flask_cors import CORS
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
+import atexit
 import os
+import queue
+import threading
+import time
 from ai.agent import IAAgentHybrid
 from settings.user_settings import UserSettings
 from chat.history import ChatHistory
 import logging
 from werkzeug.exceptions import HTTPException
-import re
+from werkzeug.middleware.shared_data import SharedDataMiddleware
 import bleach  # Biblioteca para sanitização HTML
 import secrets  # Para geração de tokens seguros
+from flask.json.provider import DefaultJSONProvider
+from jsonutil import orjson  # None sem a wheel: mantém o JSON padrão do Flask
 
 # Configuração de logging mais detalhada
 import logging
@@ -49,9 +55,75 @@ TEMPLATES_DIR = os.path.join(FRONTEND_DIR, 'templates')
 LLAMA2_CHAT_PATH = os.path.join(BASE_DIR, '../model/llama-2-7b-chat.Q4_K_M.gguf')
 STABLE_CODE_PATH = os.path.join(BASE_DIR, '../model/stable-code-3b.Q8_0.gguf')
 
+_ROBOTS_TXT = 'User-agent: *\nDisallow:'
+
+# Tabelas de sanitização para str.translate (remoção sem regex)
+_STRIP_CTRL = dict.fromkeys([*range(0x20), 0x7F])
+_STRIP_FILENAME_CHARS = dict.fromkeys(map(ord, '<>:"/\\|?*'))
+
 # 🔧 Corrigido: agora o static_folder aponta para a pasta frontend inteira
 app = Flask(__name__, template_folder=TEMPLATES_DIR, static_folder=FRONTEND_DIR)
 
+class OrjsonProvider(DefaultJSONProvider):
+    """Provedor JSON do Flask baseado em orjson (jsonify e request.get_json)."""
+
+    ensure_ascii = False  # orjson sempre emite UTF-8
+
+    def dumps(self, obj, **kwargs):
+        # response()/jsonify sempre passa separators compactos ou indent=2: ambos viram
+        # opções do orjson; só o que ele não expressa cai no json padrão do Flask
+        options = dict(kwargs)
+        separators = options.pop('separators', None)
+        indent = options.pop('indent', None)
+        sort_keys = options.pop('sort_keys', self.sort_keys)
+        default = options.pop('default', self.default)
+        ensure_ascii = options.pop('ensure_ascii', self.ensure_ascii)
+        if options or ensure_ascii or indent not in (None, 2) or separators not in (None, (',', ':')):
+            return super().dumps(obj, **kwargs)
+        option = orjson.OPT_NON_STR_KEYS
+        if indent == 2:
+            option |= orjson.OPT_INDENT_2
+        if sort_keys:  # Respeita app.json.sort_keys como o DefaultJSONProvider
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=default, option=option).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+
+if orjson is not None:
+    app.json = OrjsonProvider(app)
+
+# Headers de segurança de todas as respostas (views do Flask e arquivos estáticos)
+_SECURITY_HEADERS = (
+    ('X-Content-Type-Options', 'nosniff'),
+    ('X-Frame-Options', 'SAMEORIGIN'),
+    ('Content-Security-Policy', "default-src 'self'; script-src 'self' https://cdnjs.cloudflare.com"),
+    ('Referrer-Policy', 'strict-origin-when-cross-origin'),
+)
+
+
+def _with_security_headers(wsgi_app):
+    """Middleware WSGI que acrescenta os headers de segurança ausentes na resposta."""
+    def middleware(environ, start_response):
+        def start(status, headers, exc_info=None):
+            present = {name.lower() for name, _ in headers}
+            headers.extend(h for h in _SECURITY_HEADERS if h[0].lower() not in present)
+            return start_response(status, headers, exc_info)
+        return wsgi_app(environ, start)
+    return middleware
+
+
+# Arquivos estáticos servidos direto na camada WSGI, sem roteamento/views do Flask.
+# Arquivos inexistentes seguem para as rotas abaixo (favicon -> 204, static -> 404).
+# O shim externo garante nosniff/CSP/XFO também nessas respostas (after_request não as vê)
+app.wsgi_app = _with_security_headers(SharedDataMiddleware(app.wsgi_app, {
+    '/static': FRONTEND_DIR,
+    '/favicon.ico': os.path.join(FRONTEND_DIR, 'favicon.ico'),
+}, cache_timeout=24 * 60 * 60))
+
 # Configurações de segurança e performance
 app.config['JSON_SORT_KEYS'] = False
 app.config['PROPAGATE_EXCEPTIONS'] = True
@@ -61,12 +133,13 @@ CORS(app, resources={
     r"/api/*": {"origins": ["http://localhost:5000", "http://127.0.0.1:5000"]}
 })
 
-# Rate limiting configurado por endpoint
+# Rate limiting configurado por endpoint. O backend pode ser trocado por Redis
+# (ex.: RATELIMIT_STORAGE_URI=redis://localhost:6379/0) em implantações multiusuário
 limiter = Limiter(
     app=app,
     key_func=get_remote_address,
     default_limits=["200 per day", "50 per hour"],
-    storage_uri="memory://"
+    storage_uri=os.environ.get("RATELIMIT_STORAGE_URI", "memory://")
 )
 
 # Inicialização dos componentes com tratamento de erros
@@ -78,33 +151,115 @@ except Exception as e:
     logger.error(f"Erro na inicialização dos componentes: {e}")
     raise
 
-
-def validate_json_payload(f):
-    """Middleware simples para validar payload JSON."""
-    def wrapper(*args, **kwargs):
-        if not request.is_json:
-            return jsonify(error="Payload deve ser JSON."), 400
+# Gravação do histórico fora da requisição: a rota só enfileira (role, msg) e uma
+# thread grava em lotes de até _HIST_BATCH mensagens ou a cada _HIST_FLUSH_INTERVAL s
+_HIST_BATCH = 50
+_HIST_FLUSH_INTERVAL = 1.0
+_HIST_PUT_TIMEOUT = 5.0
+_hist_queue = queue.Queue(maxsize=1000)
+_hist_lock = threading.Lock()  # Serializa gravações do lote com /api/chat/clear
+_HIST_FLUSH = object()  # Sentinela: encerra o lote atual e grava sem esperar o intervalo
+
+
+def _drain_history(block=True):
+    """Coleta um lote da fila e grava no histórico; retorna o número de itens consumidos."""
+    batch = []
+    taken = 0
+    deadline = None  # Começa a contar na primeira mensagem, não durante a espera ociosa
+    while len(batch) < _HIST_BATCH:
         try:
-            request.get_json(force=True)
-        except Exception:
-            return jsonify(error="JSON inválido."), 400
-        return f(*args, **kwargs)
-    wrapper.__name__ = f.__name__
-    return wrapper
+            if block:
+                timeout = deadline - time.monotonic() if deadline is not None else None
+                if timeout is not None and timeout <= 0:
+                    break
+                item = _hist_queue.get(timeout=timeout)
+            else:
+                item = _hist_queue.get_nowait()
+        except queue.Empty:
+            break
+        taken += 1
+        if item is _HIST_FLUSH:
+            break
+        if deadline is None:
+            deadline = time.monotonic() + _HIST_FLUSH_INTERVAL
+        batch.append(item)
+    try:
+        if batch:
+            with _hist_lock:
+                chat_history.add_messages(batch)
+    except Exception as e:
+        logger.error(f"Erro ao gravar histórico: {e}")
+    finally:
+        # task_done só após a gravação: join() cobre também o lote em andamento
+        for _ in range(taken):
+            _hist_queue.task_done()
+    return taken
+
+
+def _history_writer():
+    while True:
+        _drain_history()
+
+
+def flush_history():
+    """Grava todas as mensagens pendentes, inclusive o lote retido pela thread."""
+    if _hist_writer.is_alive():
+        # A sentinela faz a thread gravar o lote atual na hora; join() espera a gravação
+        _hist_queue.put(_HIST_FLUSH)
+        _hist_queue.join()
+    else:
+        while _drain_history(block=False):
+            pass
+
+
+def _queue_history(role, msg):
+    try:
+        # Fila cheia (disco lento): espera a vaga em vez de passar à frente das pendentes
+        _hist_queue.put((role, msg), timeout=_HIST_PUT_TIMEOUT)
+    except queue.Full:
+        # Último recurso (thread de gravação travada): grava direto para não perder a mensagem
+        logger.warning("Fila do histórico cheia; gravando mensagem fora de ordem")
+        with _hist_lock:
+            chat_history.add_message(msg, role)
+
+
+_hist_writer = threading.Thread(target=_history_writer, name="chat-history-writer", daemon=True)
+_hist_writer.start()
+atexit.register(flush_history)  # Encerramento: nada fica na fila nem no lote da thread
+
+
+@app.before_request
+def validate_json_payload():
+    """Valida o payload JSON de todo POST da API em um único ponto."""
+    if request.method != 'POST' or not request.path.startswith('/api/'):
+        return None
+    if not request.is_json:
+        return jsonify(error="Payload deve ser JSON."), 400
+    # Parse único: get_json() não silencioso guarda o resultado no cache da requisição,
+    # então as rotas reutilizam o mesmo objeto ao chamar request.get_json()
+    try:
+        data = request.get_json()
+    except Exception:
+        return jsonify(error="JSON inválido."), 400
+    if data is None:
+        return jsonify(error="JSON inválido."), 400
+    return None
 
 
 def sanitize_input(input_string):
     """Sanitiza entradas para prevenir injeção e ataques."""
     if not isinstance(input_string, str):
         return ''
-    input_string = re.sub(r'[\x00-\x1F\x7F]', '', input_string)
-    input_string = input_string[:2000]
+    input_string = input_string.translate(_STRIP_CTRL)[:2000]
+    # Texto puro (caso comum): sem <, > ou & o bleach não alteraria nada
+    if '<' not in input_string and '>' not in input_string and '&' not in input_string:
+        return input_string
     return bleach.clean(input_string, strip=True)
 
 
 def validate_filename(filename):
     """Valida e sanitiza nomes de arquivo."""
-    filename = re.sub(r'[<>:"/\\|?*]', '', filename)
+    filename = filename.translate(_STRIP_FILENAME_CHARS)
     filename = filename[:255]
     return filename or 'arquivo_gerado.txt'
 
@@ -112,10 +267,8 @@ def validate_filename(filename):
 @app.after_request
 def security_headers(response):
     """Adiciona headers de segurança em todas as respostas."""
-    response.headers['X-Content-Type-Options'] = 'nosniff'
-    response.headers['X-Frame-Options'] = 'SAMEORIGIN'
-    response.headers['Content-Security-Policy'] = "default-src 'self'; script-src 'self' https://cdnjs.cloudflare.com"
-    response.headers['Referrer-Policy'] = 'strict-origin-when-cross-origin'
+    for name, value in _SECURITY_HEADERS:
+        response.headers[name] = value
     return response
 
 
@@ -140,13 +293,13 @@ def handle_exception(e):
 
 
 @app.route("/api/ping")
+@limiter.exempt
 def ping():
     return {"result": "pong"}
 
 
 @app.route("/api/chat", methods=["POST"])
 @limiter.limit("10/minute")
-@validate_json_payload
 def chat_api():
     try:
         data = request.get_json()
@@ -163,10 +316,10 @@ def chat_api():
         if (not reply or reply.startswith('Erro:')) and not code:
             return jsonify(error="Não foi possível processar a solicitação."), 200
 
-        chat_history.add_message(user_msg, "user")
-        chat_history.add_message(reply, "assistant")
+        _queue_history("user", user_msg)
+        _queue_history("assistant", reply)
         if code:
-            chat_history.add_message(code, "code")
+            _queue_history("code", code)
 
         return jsonify(result=reply, code=code, code_type=code_type)
     except ValueError as e:
@@ -178,9 +331,10 @@ def chat_api():
 
 
 @app.route("/api/status")
+@limiter.exempt
 def status():
-    chat_ready = (hybrid_agent.models.get('chat', None) is not None)
-    code_ready = (hybrid_agent.models.get('code', None) is not None)
+    chat_ready = hybrid_agent.is_model_ready('chat')
+    code_ready = hybrid_agent.is_model_ready('code')
     return jsonify({
         "ia_chat_online": chat_ready,
         "ia_code_online": code_ready,
@@ -200,7 +354,10 @@ def favicon():
 @app.route("/api/chat/history")
 def get_chat_history():
     try:
-        history_raw = chat_history.get_history()
+        # Pendentes gravados primeiro; cópia sob o lock (a thread anexa e poda a lista)
+        flush_history()
+        with _hist_lock:
+            history_raw = list(chat_history.get_history())
         history = []
         for msg in history_raw:
             tipo = msg.get('role', msg.get('tipo', 'user'))
@@ -213,10 +370,12 @@ def get_chat_history():
 
 
 @app.route("/api/chat/clear", methods=["POST"])
-@validate_json_payload
 def clear_chat_history():
     try:
-        chat_history.clear()
+        # Mensagens pendentes (inclusive o lote em gravação) vão ao arquivo antes da limpeza
+        flush_history()
+        with _hist_lock:
+            chat_history.clear()
         return jsonify({"success": True}), 200
     except Exception as e:
         logger.error(f"Erro ao limpar histórico: {str(e)}")
@@ -226,7 +385,8 @@ def clear_chat_history():
 @app.route('/robots.txt')
 def robots():
     from flask import Response
-    return Response('User-agent: *\nDisallow:', status=200, mimetype='text/plain')
+    return Response(_ROBOTS_TXT, status=200, mimetype='text/plain',
+                    headers={'Cache-Control': 'public, max-age=86400'})
 
 
 @app.route("/api/settings", methods=["GET"])
@@ -244,9 +404,11 @@ def update_settings():
         data = request.get_json()
         if not data:
             return jsonify(error="Dados não recebidos."), 400
-        for key, value in data.items():
-            user_settings.set(key, value)
-        if user_settings.save_settings():
+        ok = True
+        with user_settings.batch():  # Uma única escrita no log; o log já persiste as chaves
+            for key, value in data.items():
+                ok = user_settings.set(key, value) and ok
+        if ok:
             return jsonify(success=True, message="Configurações salvas com sucesso."), 200
         else:
             return jsonify(error="Erro ao salvar configurações."), 500
@@ -296,7 +458,6 @@ def update_workspace():
 
 
 @app.route("/api/clear_prompt_cache", methods=["POST"])
-@validate_json_payload
 def clear_prompt_cache():
     try:
         data = request.get_json()
@@ -311,7 +472,6 @@ def clear_prompt_cache():
 
 
 @app.route("/api/save_code", methods=["POST"])
-@validate_json_payload
 def save_code():
     try:
         data = request.get_json()
@@ -381,12 +541,23 @@ if __name__ == "__main__":
         print(f"Servidor rodando em: http://127.0.0.1:{port}")
         logger.info(f"Iniciando servidor Flask em http://127.0.0.1:{port}")
         logger.info(f"Modo de depuração: {'Ativado' if app.debug else 'Desativado'}")
-        app.run(
-            host='0.0.0.0',
-            port=port,
-            debug=False,
-            use_reloader=False
-        )
+        try:
+            from waitress import serve  # Servidor WSGI de produção (multithread)
+        except ImportError:
+            serve = None
+        if serve is not None:
+            # Processo único com várias threads: vários workers duplicariam os modelos na RAM
+            logger.info("Servidor WSGI: waitress (8 threads)")
+            serve(app, host='0.0.0.0', port=port, threads=8)
+        else:
+            logger.warning("waitress não instalado; usando servidor de desenvolvimento do Flask")
+            app.run(
+                host='0.0.0.0',
+                port=port,
+                debug=False,
+                use_reloader=False,
+                threaded=True
+            )
     except Exception as e:
         logger.critical(f"Falha crítica ao iniciar servidor: {e}")
         raise
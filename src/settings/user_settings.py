@@ -3,213 +3,456 @@ Sistema de Persistência de Configurações do Usuário
 Gerencia preferências, temas, configurações de IA e histórico
 """
 
-import json
+import atexit
+import copy
+import hashlib
+import logging
 import os
+import threading
+import time
 from typing import Dict, Any, Optional
 from datetime import datetime
+from contextlib import contextmanager
+from functools import lru_cache
+from itertools import islice
+
+import jsonutil
+
+logger = logging.getLogger("user_settings")
+
+# Log de alterações (WAL): cada set() anexa só o delta; o JSON completo é
+# regravado (compactação) ao atingir um destes limites ou no encerramento
+_LOG_MAX_ENTRIES = 32
+_LOG_MAX_BYTES = 64 * 1024
+
+# Caminhos pré-divididos das chaves usadas internamente
+_K_LAST_FILES = ("workspace", "last_files")
+_K_FAV_TPL = ("workspace", "favorite_templates")
+
+_MISSING = object()  # Sentinela: distingue chave ausente de valor None armazenado
+
+@lru_cache(maxsize=1)
+def _iso_second(sec: int) -> str:
+    """Horário local em ISO 8601 para um segundo da época (um único formato por segundo)."""
+    return datetime.fromtimestamp(sec).isoformat()
+
+def _now_iso() -> str:
+    """Horário atual com resolução de segundos, reaproveitado em gravações frequentes."""
+    return _iso_second(int(time.time()))
+
+@lru_cache(maxsize=256)
+def _split(key: str) -> tuple:
+    """Caminho de uma chave em notação de ponto (as mesmas chaves são lidas repetidamente)."""
+    return tuple(key.split('.'))
+
+def _write_atomic(path: str, data: bytes):
+    """Grava o buffer inteiro em um arquivo temporário e o troca pelo destino (os.replace)."""
+    tmp_path = f"{path}.tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        view = memoryview(data)
+        while view:  # Normalmente uma única chamada; o laço cobre escritas parciais
+            view = view[os.write(fd, view):]
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    os.replace(tmp_path, path)
+
+def _append_line(path: str, data: bytes):
+    """Anexa uma linha ao arquivo com uma única chamada os.write (O_APPEND)."""
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+    try:
+        os.write(fd, data)
+    finally:
+        os.close(fd)
+
+def _encode_change(key: str, value: Any) -> bytes:
+    """Linha JSON compacta de uma alteração do log: {"k": chave, "v": valor}."""
+    return jsonutil.dumps_line({"k": key, "v": value})
+
+def _set_path(settings: Dict[str, Any], keys: tuple, value: Any):
+    """Define o valor no caminho, criando os níveis intermediários ausentes."""
+    for k in keys[:-1]:
+        if k not in settings:
+            settings[k] = {}
+        settings = settings[k]
+    settings[keys[-1]] = value
+
+# Configurações padrão (sem created_at/last_updated, definidos na carga).
+# Modelo compartilhado: nunca é modificado, só copiado
+_DEFAULT_SETTINGS_TEMPLATE = {
+    "theme": "dark",
+    "language": "pt-BR",
+    "ai_preferences": {
+        "response_style": "balanced",  # balanced, creative, precise
+        "code_generation": {
+            "style": "template_first",
+            "max_tokens": 2048,
+            "temperature": 0.2,
+            "top_p": 0.95,
+            "frequency_penalty": 0.1,
+            "presence_penalty": 0.1
+        },
+        "chat": {
+            "max_history": 1000,
+            "context_window": 4096,
+            "temperature": 0.7,
+            "enable_web_search": True
+        },
+        "cache_settings": {
+            "enabled": True,
+            "max_size": 1000,
+            "ttl_hours": 24
+        }
+    },
+    "ui_preferences": {
+        "sidebar_collapsed": False,
+        "auto_save": True,
+        "show_line_numbers": True,
+        "font_size": 14,
+        "tab_size": 4
+    },
+    "workspace": {
+        "last_files": [],
+        "recent_projects": [],
+        "favorite_templates": []
+    },
+    "notifications": {
+        "show_toasts": True,
+        "sound_enabled": True,
+        "ai_status_alerts": True
+    }
+}
+
+def _merge_defaults(settings: Dict[str, Any], defaults: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Completa `settings` recursivamente com as chaves ausentes de `defaults`.
+    
+    Valores do usuário prevalecem nas folhas; seções parciais (ex.: só
+    ai_preferences.chat.temperature) mantêm os demais padrões. Só as
+    subárvores ausentes são copiadas.
+    """
+    for key, value in defaults.items():
+        current = settings.get(key)
+        if key not in settings:
+            settings[key] = copy.deepcopy(value)
+        elif isinstance(current, dict) and isinstance(value, dict):
+            _merge_defaults(current, value)
+    return settings
 
 class UserSettings:
     """Gerenciador de configurações persistentes do usuário"""
     
+    # Sem __dict__ por instância; __weakref__ mantém a classe referenciável por weakref
+    __slots__ = (
+        "settings_file", "log_file", "settings",
+        "_dirty", "_log_entries", "_log_bytes",
+        "_save_lock", "_write_lock",
+        "_last_hash", "_loaded_mtime",
+        "_batch_depth", "_batch_lines",
+        "__weakref__",
+    )
+    
+    _VALID_THEMES = frozenset(("dark", "light", "auto"))
+    _VALID_LANGUAGES = frozenset(("pt-BR", "en-US", "es-ES"))
+    
     def __init__(self, settings_file: str = "user_settings.json"):
         self.settings_file = settings_file
+        self.log_file = os.path.splitext(settings_file)[0] + ".log"  # Ex.: user_settings.log
+        self._dirty = False  # Há alterações fora do JSON completo (só no log)
+        self._log_entries = 0
+        self._log_bytes = 0
+        self._save_lock = threading.Lock()
+        self._write_lock = threading.Lock()  # Serializa anexos ao log e compactações
+        self._last_hash = None  # Hash do conteúdo gravado (sem last_updated)
+        self._loaded_mtime = None  # mtime do JSON lido/gravado, para reload()
+        self._batch_depth = 0  # batch() aninhados em andamento
+        self._batch_lines = []  # Linhas do log retidas até o fim do batch()
         self.settings = self._load_settings()
+        atexit.register(self._flush)  # Compacta alterações pendentes no encerramento
     
     def _load_settings(self) -> Dict[str, Any]:
         """Carrega configurações do arquivo ou cria padrões"""
-        default_settings = {
-            "theme": "dark",
-            "language": "pt-BR",
-            "ai_preferences": {
-                "response_style": "balanced",  # balanced, creative, precise
-                "code_generation": {
-                    "style": "template_first",
-                    "max_tokens": 2048,
-                    "temperature": 0.2,
-                    "top_p": 0.95,
-                    "frequency_penalty": 0.1,
-                    "presence_penalty": 0.1
-                },
-                "chat": {
-                    "max_history": 1000,
-                    "context_window": 4096,
-                    "temperature": 0.7,
-                    "enable_web_search": True
-                },
-                "cache_settings": {
-                    "enabled": True,
-                    "max_size": 1000,
-                    "ttl_hours": 24
-                }
-            },
-            "ui_preferences": {
-                "sidebar_collapsed": False,
-                "auto_save": True,
-                "show_line_numbers": True,
-                "font_size": 14,
-                "tab_size": 4
-            },
-            "workspace": {
-                "last_files": [],
-                "recent_projects": [],
-                "favorite_templates": []
-            },
-            "notifications": {
-                "show_toasts": True,
-                "sound_enabled": True,
-                "ai_status_alerts": True
-            },
-            "created_at": datetime.now().isoformat(),
-            "last_updated": datetime.now().isoformat()
-        }
+        now = _now_iso()
+        self._loaded_mtime = None
+        try:
+            # EAFP: abre direto (sem exists() prévio); o mtime vem do próprio descritor
+            with open(self.settings_file, 'rb') as f:
+                mtime = os.fstat(f.fileno()).st_mtime_ns
+                loaded_settings = jsonutil.loads(f.read())
+            self._loaded_mtime = mtime
+            if isinstance(loaded_settings, dict):
+                # Merge profundo com padrões para novas configurações
+                settings = _merge_defaults(loaded_settings, _DEFAULT_SETTINGS_TEMPLATE)
+                settings.setdefault("created_at", now)
+                settings["last_updated"] = now
+                self._replay_log(settings)
+                return settings
+            logger.error("Erro ao carregar configurações: conteúdo não é um objeto JSON")
+        except FileNotFoundError:
+            pass  # Primeira execução: usa os padrões
+        except ValueError as e:  # JSONDecodeError (json e orjson) ou UTF-8 inválido
+            logger.error("Erro ao carregar configurações: %s", e)
         
+        # Sem arquivo válido: cópia completa dos padrões
+        settings = copy.deepcopy(_DEFAULT_SETTINGS_TEMPLATE)
+        settings["created_at"] = now
+        settings["last_updated"] = now
+        self._replay_log(settings)
+        return settings
+    
+    def reload(self) -> bool:
+        """Relê o arquivo só se ele mudou desde a última leitura/gravação (mtime)."""
         try:
-            if os.path.exists(self.settings_file):
-                with open(self.settings_file, 'r', encoding='utf-8') as f:
-                    loaded_settings = json.load(f)
-                    # Merge com padrões para novas configurações
-                    default_settings.update(loaded_settings)
-                    default_settings["last_updated"] = datetime.now().isoformat()
-                    return default_settings
-        except (json.JSONDecodeError, FileNotFoundError) as e:
-            print(f"[UserSettings] Erro ao carregar configurações: {e}")
+            mtime = os.stat(self.settings_file).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self._loaded_mtime:
+            return False
+        self.settings = self._load_settings()
+        return True
+    
+    def _replay_log(self, settings: Dict[str, Any]):
+        """Reaplica sobre o JSON carregado as alterações ainda não compactadas."""
+        self._log_entries = 0
+        self._log_bytes = 0
+        try:
+            with open(self.log_file, 'rb') as f:
+                lines = f.read().splitlines()
+        except FileNotFoundError:
+            return
+        for line in lines:
+            try:
+                change = jsonutil.loads(line)
+                _set_path(settings, _split(change["k"]), change["v"])
+            except Exception:
+                continue  # Linha truncada por encerramento abrupto
+            self._log_entries += 1
+            self._log_bytes += len(line) + 1
+        if self._log_entries:
+            self._dirty = True
+    
+    def _log_change(self, key: str, value: Any):
+        """Anexa a alteração ao log; compacta no JSON completo ao atingir o limite."""
+        data = _encode_change(key, value)
+        with self._save_lock:
+            self._dirty = True
+        with self._write_lock:
+            if self._batch_depth:
+                self._batch_lines.append(data)  # Gravado de uma vez ao fim do batch()
+                return
+        self._append_log([data])
+    
+    def _append_log(self, lines: list):
+        """Grava linhas do log em uma única escrita e compacta se o limite foi atingido."""
+        data = b''.join(lines)
+        with self._write_lock:
+            try:
+                _append_line(self.log_file, data)
+            except OSError as e:
+                logger.error("Erro ao registrar alterações: %s", e)
+            self._log_entries += len(lines)
+            self._log_bytes += len(data)
+            compact = self._log_entries >= _LOG_MAX_ENTRIES or self._log_bytes >= _LOG_MAX_BYTES
+        if compact:
+            self.save_settings()
+    
+    @contextmanager
+    def batch(self):
+        """
+        Agrupa várias alterações em uma única escrita no log.
         
-        return default_settings
+        Uso:
+            with settings.batch():
+                settings.update_ui_preferences({...})
+                settings.add_recent_file(path)
+        """
+        with self._write_lock:
+            self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            with self._write_lock:
+                self._batch_depth -= 1
+                lines = self._batch_lines if not self._batch_depth else None
+                if lines is not None:
+                    self._batch_lines = []
+            if lines:
+                self._append_log(lines)
     
-    def save_settings(self) -> bool:
-        """Salva configurações no arquivo"""
+    def _flush(self) -> bool:
+        """Grava as configurações apenas se houver alterações pendentes."""
+        return self.save_settings(force=False)
+    
+    def save_settings(self, force: bool = True, pretty: bool = False) -> bool:
+        """
+        Salva configurações no arquivo.
+        
+        force=False grava só se houver alterações; pretty=True indenta o JSON
+        para edição manual (o padrão compacto tem cerca de metade do tamanho).
+        """
+        with self._save_lock:
+            if not force and not self._dirty:
+                return True
+            self._dirty = False
         try:
-            self.settings["last_updated"] = datetime.now().isoformat()
-            with open(self.settings_file, 'w', encoding='utf-8') as f:
-                json.dump(self.settings, f, indent=2, ensure_ascii=False)
+            with self._write_lock:
+                # Conteúdo igual ao último gravado: não toca last_updated nem o disco
+                content = jsonutil.dumps({k: v for k, v in self.settings.items() if k != "last_updated"})
+                content_hash = hashlib.blake2b(content, digest_size=16).digest()
+                if content_hash != self._last_hash:
+                    self.settings["last_updated"] = _now_iso()
+                    data = jsonutil.dumps(self.settings, pretty)
+                    _write_atomic(self.settings_file, data)
+                    self._loaded_mtime = os.stat(self.settings_file).st_mtime_ns  # Nossa gravação não pede reload
+                    self._last_hash = content_hash
+                # JSON completo em dia: o log pode ser descartado
+                if self._log_entries:
+                    with open(self.log_file, 'wb'):
+                        pass
+                    self._log_entries = 0
+                    self._log_bytes = 0
             return True
         except Exception as e:
-            print(f"[UserSettings] Erro ao salvar configurações: {e}")
+            logger.error("Erro ao salvar configurações: %s", e)
+            self._dirty = True  # Mantém pendente para a próxima tentativa
             return False
     
     def get(self, key: str, default: Any = None) -> Any:
         """Obtém valor de configuração usando notação de ponto"""
-        keys = key.split('.')
+        return self._get_path(_split(key), default)
+    
+    def _get_path(self, keys: tuple, default: Any = None) -> Any:
+        """Obtém valor por caminho já dividido (chaves internas usam tuplas constantes)."""
+        # dict.get em vez de try/except: chaves ausentes são comuns e não levantam exceção
         value = self.settings
-        
-        try:
-            for k in keys:
-                value = value[k]
-            return value
-        except (KeyError, TypeError):
-            return default
+        for k in keys:
+            if not isinstance(value, dict):
+                return default
+            value = value.get(k, _MISSING)
+            if value is _MISSING:
+                return default
+        return value
     
     def set(self, key: str, value: Any) -> bool:
         """Define valor de configuração usando notação de ponto"""
-        keys = key.split('.')
-        settings = self.settings
-        
+        return self._set_keys(_split(key), value, key)
+    
+    def _set_keys(self, keys: tuple, value: Any, key: Optional[str] = None) -> bool:
+        """Define valor por caminho já dividido; `key` é a forma pontuada usada no log."""
+        if key is None:
+            key = '.'.join(keys)
         try:
-            # Navegar até o penúltimo nível
-            for k in keys[:-1]:
-                if k not in settings:
-                    settings[k] = {}
-                settings = settings[k]
-            
-            # Definir o valor final
-            settings[keys[-1]] = value
+            _set_path(self.settings, keys, value)
+            self._log_change(key, value)
             return True
         except Exception as e:
-            print(f"[UserSettings] Erro ao definir configuração {key}: {e}")
+            logger.error("Erro ao definir configuração %s: %s", key, e)
             return False
     
     def update_theme(self, theme: str) -> bool:
         """Atualiza tema do usuário"""
-        valid_themes = ["dark", "light", "auto"]
-        if theme in valid_themes:
+        if isinstance(theme, str) and theme in self._VALID_THEMES:
             return self.set("theme", theme)
         return False
     
     def update_language(self, language: str) -> bool:
         """Atualiza idioma do usuário"""
-        valid_languages = ["pt-BR", "en-US", "es-ES"]
-        if language in valid_languages:
+        if isinstance(language, str) and language in self._VALID_LANGUAGES:
             return self.set("language", language)
         return False
     
     def update_ai_preferences(self, preferences: Dict[str, Any]) -> bool:
         """Atualiza preferências da IA"""
-        current_prefs = self.get("ai_preferences", {})
-        current_prefs.update(preferences)
-        return self.set("ai_preferences", current_prefs)
+        # Atualização no próprio dicionário: um único acesso, sem reatribuir a seção
+        section = self.settings.setdefault("ai_preferences", {})
+        section.update(preferences)
+        self._log_change("ai_preferences", section)
+        return True
     
     def update_ui_preferences(self, preferences: Dict[str, Any]) -> bool:
         """Atualiza preferências da interface"""
-        current_prefs = self.get("ui_preferences", {})
-        current_prefs.update(preferences)
-        return self.set("ui_preferences", current_prefs)
+        # Atualização no próprio dicionário: um único acesso, sem reatribuir a seção
+        section = self.settings.setdefault("ui_preferences", {})
+        section.update(preferences)
+        self._log_change("ui_preferences", section)
+        return True
     
     def add_recent_file(self, file_path: str) -> bool:
         """Adiciona arquivo ao histórico recente"""
-        recent_files = self.get("workspace.last_files", [])
+        recent_files = self._get_path(_K_LAST_FILES, [])
         
-        # Remove se já existir
-        if file_path in recent_files:
-            recent_files.remove(file_path)
-        
-        # Adiciona no início
-        recent_files.insert(0, file_path)
+        # dict ordenado como LRU: coloca o arquivo no início e descarta a ocorrência
+        # antiga em uma única passada (sem busca + remove na lista)
+        recent = dict.fromkeys((file_path, *recent_files))
         
         # Limita a 10 arquivos
-        recent_files = recent_files[:10]
+        recent_files = list(islice(recent, 10))
         
-        return self.set("workspace.last_files", recent_files)
+        return self._set_keys(_K_LAST_FILES, recent_files)
     
     def add_favorite_template(self, template_name: str) -> bool:
         """Adiciona template aos favoritos"""
-        favorites = self.get("workspace.favorite_templates", [])
+        favorites = self._get_path(_K_FAV_TPL, [])
         
         if template_name not in favorites:
             favorites.append(template_name)
             # Limita a 5 favoritos
             favorites = favorites[-5:]
-            return self.set("workspace.favorite_templates", favorites)
+            return self._set_keys(_K_FAV_TPL, favorites)
         
         return True
     
     def get_workspace_stats(self) -> Dict[str, Any]:
         """Retorna estatísticas do workspace"""
+        # Acesso direto: uma travessia em vez de quatro get() com notação de ponto
+        settings = self.settings
+        workspace = settings.get("workspace", {})
         return {
-            "total_files": len(self.get("workspace.last_files", [])),
-            "favorite_templates": len(self.get("workspace.favorite_templates", [])),
-            "created_at": self.get("created_at"),
-            "last_updated": self.get("last_updated")
+            "total_files": len(workspace.get("last_files", [])),
+            "favorite_templates": len(workspace.get("favorite_templates", [])),
+            "created_at": settings.get("created_at"),
+            "last_updated": settings.get("last_updated")
         }
     
     def reset_to_defaults(self) -> bool:
         """Reseta configurações para padrões"""
         try:
-            if os.path.exists(self.settings_file):
-                os.remove(self.settings_file)
+            with self._write_lock:
+                for path in (self.settings_file, self.log_file):
+                    if os.path.exists(path):
+                        os.remove(path)
+                self._log_entries = 0
+                self._log_bytes = 0
             self.settings = self._load_settings()
+            with self._save_lock:
+                self._dirty = False
+                self._last_hash = None  # Arquivo removido: a próxima gravação é obrigatória
             return True
         except Exception as e:
-            print(f"[UserSettings] Erro ao resetar configurações: {e}")
+            logger.error("Erro ao resetar configurações: %s", e)
             return False
     
-    def export_settings(self, export_path: str) -> bool:
-        """Exporta configurações para arquivo"""
+    def export_settings(self, export_path: str, pretty: bool = True) -> bool:
+        """Exporta configurações para arquivo (indentado por padrão, para edição manual)"""
         try:
-            with open(export_path, 'w', encoding='utf-8') as f:
-                json.dump(self.settings, f, indent=2, ensure_ascii=False)
+            _write_atomic(export_path, jsonutil.dumps(self.settings, pretty))
             return True
         except Exception as e:
-            print(f"[UserSettings] Erro ao exportar configurações: {e}")
+            logger.error("Erro ao exportar configurações: %s", e)
             return False
     
     def import_settings(self, import_path: str) -> bool:
         """Importa configurações de arquivo"""
         try:
-            with open(import_path, 'r', encoding='utf-8') as f:
-                imported_settings = json.load(f)
-                self.settings.update(imported_settings)
-                return self.save_settings()
+            with open(import_path, 'rb') as f:
+                data = f.read()
+            imported_settings = jsonutil.loads(data)
+            if all(self.settings.get(k, _MISSING) == v for k, v in imported_settings.items()):
+                return True  # Nenhum valor diferente: dispensa a gravação
+            self.settings.update(imported_settings)
+            return self.save_settings()
         except Exception as e:
-            print(f"[UserSettings] Erro ao importar configurações: {e}")
+            logger.error("Erro ao importar configurações: %s", e)
             return False
 